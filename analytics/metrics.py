@@ -2,88 +2,112 @@ import numpy as np
 import pandas as pd
 
 
-# ---------- CORE METRICS ----------
-
-def calculate_trend(scores):
-    if len(scores) < 2:
-        return "insufficient_data"
-
-    diff = scores.iloc[-1] - scores.iloc[0]
-
-    if diff > 5:
-        return "improving"
-    elif diff < -5:
-        return "declining"
-    else:
-        return "stable"
-
-
-def improvement_velocity(scores):
-    if len(scores) < 2:
-        return 0.0
-    return round((scores.iloc[-1] - scores.iloc[0]) / len(scores), 2)
-
-
-def consistency_score(scores):
-    if len(scores) < 2:
-        return 1.0
-    return round(1 / (1 + np.std(scores)), 3)
-
-
-def mock_vs_real_gap(df):
-    mock_avg = df[df["exam_type"] == "mock"]["score"].mean()
-    real_avg = df[df["exam_type"] == "real"]["score"].mean()
-
-    if pd.isna(mock_avg) or pd.isna(real_avg):
-        return None
-
-    return round(real_avg - mock_avg, 2)
-
-
-# ---------- ADVANCED INTERPRETABLE METRICS ----------
-
-def performance_band(avg_score):
-    if avg_score < 60:
-        return "low"
-    elif avg_score < 80:
-        return "medium"
-    else:
-        return "high"
-
-
-def volatility_level(scores):
-    if len(scores) < 2:
-        return "unknown"
-
-    std = np.std(scores)
-
-    if std < 5:
-        return "low"
-    elif std < 10:
-        return "medium"
-    else:
-        return "high"
-
-
-def recent_average(scores, window=2):
-    if len(scores) < window:
-        return round(scores.mean(), 2)
-    return round(scores.iloc[-window:].mean(), 2)
-
-
-def risk_flag(avg_score, trend):
-    if avg_score < 60 and trend == "declining":
-        return "high"
-    elif avg_score < 60 or trend == "declining":
-        return "medium"
-    else:
-        return "low"
-
-
-def data_confidence(attempt_count):
-    if attempt_count >= 5:
-        return "high"
-    elif attempt_count >= 3:
-        return "medium"
-    else:
-        return "low"
+# ---------- SUBJECT METRICS ----------
+
+EXAM_TYPE_DTYPE = pd.CategoricalDtype(["mock", "real"])
+
+
+def subject_metrics(df):
+    """
+    Computes every per-(student, grade, subject) metric in a handful of
+    grouped column passes. Expects numeric scores sorted by exam_date.
+    """
+    keys = ["student_id", "grade", "subject"]
+
+    # Cast once up front (to_numeric yields int64 for whole-number sheets)
+    score = df["score"].astype(np.float64, copy=False)
+
+    # Scores split by exam type as NaN-masked columns, so the gap comes
+    # from the same grouped mean pass as everything else. The split runs
+    # on int8 category codes (mock=0, real=1, anything else=-1).
+    exam_code = df["exam_type"].astype(EXAM_TYPE_DTYPE).cat.codes.to_numpy()
+    df = df.assign(
+        score=score,
+        mock_score=score.where(exam_code == 0),
+        real_score=score.where(exam_code == 1),
+        # Categorical keys group on integer codes instead of hashing strings
+        **{key: df[key].astype("category") for key in keys},
+    )
+    g = df.groupby(keys, sort=False, observed=True, dropna=True)
+
+    # One aggregation over the shared grouper; std stays separate for ddof=0
+    stats = g["score"].agg(["first", "last", "mean", "size"])
+    std = g["score"].std(ddof=0)
+
+    first = stats["first"]
+    last = stats["last"]
+    mean = stats["mean"].round(2)
+    count = stats["size"]
+    recent = (
+        g.tail(2)
+        .groupby(keys, sort=False, observed=True)["score"]
+        .mean()
+        .round(2)
+    )
+
+    exam_means = g[["mock_score", "real_score"]].mean()
+    gap = (exam_means["real_score"] - exam_means["mock_score"]).round(2)
+
+    single = count < 2
+    diff = last - first
+
+    trend = pd.Series(
+        np.select(
+            [single, diff > 5, diff < -5],
+            ["insufficient_data", "improving", "declining"],
+            default="stable",
+        ),
+        index=count.index,
+    )
+
+    volatility = pd.cut(
+        std, bins=[-np.inf, 5, 10, np.inf], labels=["low", "medium", "high"], right=False
+    ).astype(object).where(~single, "unknown")
+
+    band = pd.cut(
+        mean, bins=[-np.inf, 60, 80, np.inf], labels=["low", "medium", "high"], right=False
+    ).astype(object)
+
+    low = mean < 60
+    declining = trend == "declining"
+    risk = pd.Series(
+        np.select([low & declining, low | declining], ["high", "medium"], default="low"),
+        index=count.index,
+    )
+
+    confidence = pd.Series(
+        np.select([count >= 5, count >= 3], ["high", "medium"], default="low"),
+        index=count.index,
+    )
+
+    out = pd.DataFrame({
+        # Volume
+        "attempt_count": count,
+
+        # Core performance
+        "average_score": mean,
+        "latest_score": last,
+        "recent_avg_score": recent,
+
+        # Trend & stability
+        "trend": trend,
+        "improvement_velocity": (diff / count).round(2).where(~single, 0.0),
+        "consistency_score": (1 / (1 + std)).round(3).where(~single, 1.0),
+        "volatility_level": volatility,
+
+        # Exam behavior
+        "mock_vs_real_gap": gap,
+
+        # Interpretable signals
+        "performance_band": band,
+        "risk_flag": risk,
+        "data_confidence_level": confidence,
+    })
+
+    # Order the (small) result like the old sorted groupby, then drop the
+    # categorical key dtypes before anything is written back
+    out = out.sort_index().reset_index()
+    out["student_id"] = out["student_id"].astype(str)
+    out["subject"] = out["subject"].astype(str)
+    out["grade"] = out["grade"].astype(int)
+    return out
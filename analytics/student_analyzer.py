@@ -3,17 +3,7 @@
 import pandas as pd
 import numpy as np
 
-from analytics.metrics import (
-    calculate_trend,
-    improvement_velocity,
-    consistency_score,
-    mock_vs_real_gap,
-    performance_band,
-    volatility_level,
-    recent_average,
-    risk_flag,
-    data_confidence,
-)
+from analytics.metrics import subject_metrics
 
 from storage.google_sheets import (
     get_gs_client,
@@ -60,60 +50,11 @@ def analyze_students():
     # Ensure chronological order for trend logic
     df = df.sort_values("exam_date")
 
-    results = []
-
     # -------------------------------------------------
-    # ANALYTICS LOGIC (SAFE & UNCHANGED)
+    # ANALYTICS LOGIC (VECTORIZED, SAME RULES)
     # -------------------------------------------------
 
-    grouped = df.groupby(["student_id", "grade", "subject"], dropna=True)
-
-    for (student_id, grade, subject), group in grouped:
-        scores = group["score"].astype(float)
-
-        # Final guard — never compute on empty or all-NaN
-        if scores.empty or scores.isna().all():
-            continue
-
-        attempt_count = len(scores)
-
-        avg_score = round(scores.mean(), 2)
-        latest_score = float(scores.iloc[-1])
-
-        trend = calculate_trend(scores)
-
-        record = {
-            # Identity
-            "student_id": student_id,
-            "grade": int(grade),
-            "subject": subject,
-
-            # Volume
-            "attempt_count": attempt_count,
-
-            # Core performance
-            "average_score": avg_score,
-            "latest_score": latest_score,
-            "recent_avg_score": recent_average(scores),
-
-            # Trend & stability
-            "trend": trend,
-            "improvement_velocity": improvement_velocity(scores),
-            "consistency_score": consistency_score(scores),
-            "volatility_level": volatility_level(scores),
-
-            # Exam behavior
-            "mock_vs_real_gap": mock_vs_real_gap(group),
-
-            # Interpretable signals
-            "performance_band": performance_band(avg_score),
-            "risk_flag": risk_flag(avg_score, trend),
-            "data_confidence_level": data_confidence(attempt_count),
-        }
-
-        results.append(record)
-
-    analytics_df = pd.DataFrame(results)
+    analytics_df = subject_metrics(df)
 
     if analytics_df.empty:
         raise RuntimeError("Phase 1 produced no analytics records")
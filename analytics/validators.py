@@ -9,6 +9,7 @@ Validated output : validated_results (Google Sheets)
 """
 
 from datetime import timezone
+import numpy as np
 import pandas as pd
 
 from storage.google_sheets import (
@@ -59,7 +60,8 @@ def validate_schema(df: pd.DataFrame):
 # ============================================================
 
 def coerce_types(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
+    # Shallow copy: every column below is reassigned, never mutated in place
+    df = df.copy(deep=False)
 
     df["student_id"] = df["student_id"].astype(str)
     df["Name"] = df["Name"].astype(str)          # ✅ SAFE PASS-THROUGH
@@ -67,6 +69,7 @@ def coerce_types(df: pd.DataFrame) -> pd.DataFrame:
     df["attempt_number"] = pd.to_numeric(df["attempt_number"], errors="coerce")
     df["score"] = pd.to_numeric(df["score"], errors="coerce")
     df["max_score"] = pd.to_numeric(df["max_score"], errors="coerce")
+    # Kept in the sheet's own timezone so the written calendar day never shifts
     df["exam_date"] = pd.to_datetime(df["exam_date"], errors="coerce")
 
     return df
@@ -76,65 +79,87 @@ def coerce_types(df: pd.DataFrame) -> pd.DataFrame:
 # ============================================================
 
 def validate_rows(df: pd.DataFrame):
-    errors = []
     now_utc = pd.Timestamp.now(tz=timezone.utc)
 
-    for idx, row in df.iterrows():
-        try:
-            if not row["student_id"].strip():
-                raise ValueError("student_id missing")
-
-            if pd.isna(row["grade"]) or not (1 <= int(row["grade"]) <= 12):
-                raise ValueError("grade out of range")
-
-            if not row["subject"].strip():
-                raise ValueError("invalid subject")
-
-            if row["exam_type"] not in ALLOWED_EXAM_TYPES:
-                raise ValueError("invalid exam_type")
-
-            if pd.isna(row["attempt_number"]) or int(row["attempt_number"]) < 1:
-                raise ValueError("invalid attempt_number")
-
-            if pd.isna(row["max_score"]) or row["max_score"] <= 0:
-                raise ValueError("invalid max_score")
-
-            if pd.isna(row["score"]) or row["score"] < 0 or row["score"] > row["max_score"]:
-                raise ValueError("score out of range")
-
-            exam_date = row["exam_date"]
-            if pd.isna(exam_date):
-                raise ValueError("invalid exam_date")
-
-            exam_date_utc = (
-                exam_date.tz_convert("UTC")
-                if exam_date.tzinfo is not None
-                else exam_date.tz_localize("UTC")
-            )
-
-            if exam_date_utc > now_utc:
-                raise ValueError("exam_date in future")
-
-        except Exception as e:
-            errors.append(
-                {
-                    "row_index": int(idx),
-                    "student_id": row.get("student_id"),
-                    "error": str(e),
-                }
-            )
+    exam_date = df["exam_date"]
+    # UTC view for the future-date check only
+    exam_date_utc = (
+        exam_date.dt.tz_convert("UTC")
+        if exam_date.dt.tz is not None
+        else exam_date.dt.tz_localize("UTC")
+    )
 
-    return errors
+    # Ordered like the original per-row checks: first failure wins
+    checks = [
+        (
+            df["student_id"].str.strip().eq(""),
+            "student_id missing",
+        ),
+        (
+            df["grade"].isna() | ~np.trunc(df["grade"]).between(1, 12),
+            "grade out of range",
+        ),
+        (
+            df["subject"].isna() | df["subject"].astype(str).str.strip().eq(""),
+            "invalid subject",
+        ),
+        (
+            ~df["exam_type"].isin(ALLOWED_EXAM_TYPES),
+            "invalid exam_type",
+        ),
+        (
+            df["attempt_number"].isna() | (np.trunc(df["attempt_number"]) < 1),
+            "invalid attempt_number",
+        ),
+        (
+            df["max_score"].isna() | (df["max_score"] <= 0),
+            "invalid max_score",
+        ),
+        (
+            df["score"].isna() | (df["score"] < 0) | (df["score"] > df["max_score"]),
+            "score out of range",
+        ),
+        (
+            exam_date.isna(),
+            "invalid exam_date",
+        ),
+        (
+            exam_date_utc > now_utc,
+            "exam_date in future",
+        ),
+    ]
+
+    messages = np.select(
+        [mask.to_numpy(dtype=bool) for mask, _ in checks],
+        [message for _, message in checks],
+        default="",
+    )
+    bad = messages != ""
+
+    return [
+        {
+            "row_index": int(idx),
+            "student_id": student_id,
+            "error": str(error),
+        }
+        for idx, student_id, error in zip(
+            df.index[bad], df["student_id"].to_numpy()[bad], messages[bad]
+        )
+    ]
 
 # ============================================================
 # UNIQUENESS
 # ============================================================
 
 def validate_uniqueness(df: pd.DataFrame):
-    dupes = df.duplicated(
-        subset=["student_id", "exam_id", "attempt_number"]
-    )
-    if dupes.any():
+    # Factorize each key column and fold the codes into one int64 key,
+    # so duplicate detection hashes integers instead of string tuples.
+    key = np.zeros(len(df), dtype=np.int64)
+    for col in ["student_id", "exam_id", "attempt_number"]:
+        codes, uniques = pd.factorize(df[col])
+        key = key * (len(uniques) + 1) + (codes + 1)
+
+    if pd.Series(key).duplicated().any():
         raise ValueError("Duplicate exam attempts detected")
 
 # ============================================================
@@ -27,6 +27,14 @@ REQUIRED_COLUMNS = {
     "mock_vs_real_gap",
 }
 
+LABEL_COLUMNS = [
+    "trend",
+    "volatility_level",
+    "risk_flag",
+    "data_confidence_level",
+    "performance_band",
+]
+
 # -------------------------------------------------
 # VALIDATION
 # -------------------------------------------------
@@ -55,85 +63,122 @@ def _sanitize_analytics(df: pd.DataFrame) -> pd.DataFrame:
     # Drop rows that are now invalid
     df = df.dropna(subset=["average_score"])
 
+    # Low-cardinality labels: rule comparisons run on category codes
+    for col in LABEL_COLUMNS:
+        df[col] = df[col].astype("category")
+
     return df
 
 # -------------------------------------------------
-# INSIGHT LOGIC (UNCHANGED)
+# INSIGHT LOGIC + EXPLAINABILITY (TRUST LAYER)
 # -------------------------------------------------
 
-def derive_primary_issue(avg, trend):
-    avg = float(avg)
+def derive_subject_insights(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Builds every subject_insights column at once from sanitized
+    subject_analytics rows.
+    """
+    low = df["average_score"] < 60
+    declining = df["trend"].eq("declining")
+    volatile = df["volatility_level"].eq("high")
+    pressured = df["mock_vs_real_gap"].lt(-5)
+
+    conditions = [low & declining, low, declining]
 
-    if avg < 60 and trend == "declining":
-        return (
+    primary_issue = np.select(
+        conditions,
+        [
             "Consistently low and declining performance",
-            "Conceptual gaps with poor reinforcement",
-            "high",
-        )
-    if avg < 60:
-        return (
             "Low overall performance",
-            "Weak foundational understanding",
-            "medium",
-        )
-    if trend == "declining":
-        return (
             "Performance regression",
+        ],
+        default="No major academic concern",
+    )
+    root_cause = np.select(
+        conditions,
+        [
+            "Conceptual gaps with poor reinforcement",
+            "Weak foundational understanding",
             "Inconsistent preparation or focus",
-            "medium",
-        )
-    return (
-        "No major academic concern",
-        "Healthy learning pattern",
-        "low",
+        ],
+        default="Healthy learning pattern",
+    )
+    urgency = np.select(conditions, ["high", "medium", "medium"], default="low")
+
+    secondary_issue = np.select(
+        [volatile, pressured],
+        [
+            "Highly inconsistent performance",
+            "Exam pressure affecting real exam performance",
+        ],
+        default="None observed",
     )
 
-def derive_secondary_issue(volatility, mock_gap):
-    if volatility == "high":
-        return "Highly inconsistent performance"
-    if pd.notna(mock_gap) and mock_gap < -5:
-        return "Exam pressure affecting real exam performance"
-    return "None observed"
-
-def derive_focus_area(urgency):
-    if urgency == "high":
-        return "Immediate concept revision and guided practice"
-    if urgency == "medium":
-        return "Structured revision and consistency building"
-    return "Maintain current learning approach"
-
-# -------------------------------------------------
-# EXPLAINABILITY (TRUST LAYER)
-# -------------------------------------------------
-
-def build_explanation(row, primary_issue):
-    signals = []
-
-    signals.append(
-        f"Average score is {row.average_score}, classified as {row.performance_band}"
+    focus_area = np.select(
+        [urgency == "high", urgency == "medium"],
+        [
+            "Immediate concept revision and guided practice",
+            "Structured revision and consistency building",
+        ],
+        default="Maintain current learning approach",
     )
 
-    signals.append(
-        f"Score trend is '{row.trend}', indicating learning direction over time"
+    # Evidence bullets, assembled column-wise
+    evidence = ("- Average score is " + df["average_score"].astype(str)).str.cat(
+        [
+            ", classified as " + df["performance_band"].astype(str),
+            "\n- Score trend is '" + df["trend"].astype(str)
+            + "', indicating learning direction over time",
+            pd.Series(
+                np.where(
+                    volatile,
+                    "\n- Scores show high volatility, suggesting inconsistency",
+                    "",
+                ),
+                index=df.index,
+            ),
+            pd.Series(
+                np.where(
+                    pressured,
+                    "\n- Mock scores significantly higher than real exam scores, "
+                    "indicating exam pressure",
+                    "",
+                ),
+                index=df.index,
+            ),
+            "\n- Academic risk flagged as '" + df["risk_flag"].astype(str)
+            + "' with " + df["data_confidence_level"].astype(str) + " confidence",
+        ]
     )
 
-    if row.volatility_level == "high":
-        signals.append("Scores show high volatility, suggesting inconsistency")
+    return pd.DataFrame({
+        "student_id": df["student_id"].to_numpy(),
+        "grade": df["grade"].astype(int).to_numpy(),
+        "subject": df["subject"].to_numpy(),
 
-    if pd.notna(row.mock_vs_real_gap) and row.mock_vs_real_gap < -5:
-        signals.append(
-            "Mock scores significantly higher than real exam scores, indicating exam pressure"
-        )
+        "primary_issue": primary_issue,
+        "secondary_issue": secondary_issue,
+        "root_cause_category": root_cause,
 
-    signals.append(
-        f"Academic risk flagged as '{row.risk_flag}' with {row.data_confidence_level} confidence"
-    )
+        "academic_risk_level": df["risk_flag"].to_numpy(),
+        "urgency_level": urgency,
+
+        "recommended_focus_area": focus_area,
+        "teacher_intervention_needed": np.where(urgency == "high", "yes", "no"),
 
-    return {
+        # Explainability
         "explanation_summary": primary_issue,
-        "key_evidence_points": signals,
-        "confidence_note": row.data_confidence_level,
-    }
+        "key_evidence_points": evidence.to_numpy(),
+
+        "confidence_in_insight": df["data_confidence_level"].to_numpy(),
+
+        "summary_signal": (
+            df["performance_band"].astype(str)
+            + " performer with "
+            + df["risk_flag"].astype(str)
+            + " risk"
+        ).to_numpy(),
+    })
 
 # -------------------------------------------------
 # PHASE 2 ENTRY POINT
@@ -155,55 +200,7 @@ def derive_insights():
     _validate_input(df)
     df = _sanitize_analytics(df)
 
-    insights = []
-
-    for row in df.itertuples(index=False):
-        primary_issue, root_cause, urgency = derive_primary_issue(
-            row.average_score,
-            row.trend,
-        )
-
-        secondary_issue = derive_secondary_issue(
-            row.volatility_level,
-            row.mock_vs_real_gap,
-        )
-
-        focus_area = derive_focus_area(urgency)
-
-        explanation = build_explanation(row, primary_issue)
-
-        teacher_needed = "yes" if urgency == "high" else "no"
-        summary_signal = f"{row.performance_band} performer with {row.risk_flag} risk"
-
-        insights.append(
-            {
-                "student_id": row.student_id,
-                "grade": int(row.grade),
-                "subject": row.subject,
-
-                "primary_issue": primary_issue,
-                "secondary_issue": secondary_issue,
-                "root_cause_category": root_cause,
-
-                "academic_risk_level": row.risk_flag,
-                "urgency_level": urgency,
-
-                "recommended_focus_area": focus_area,
-                "teacher_intervention_needed": teacher_needed,
-
-                # Explainability
-                "explanation_summary": explanation["explanation_summary"],
-                "key_evidence_points": "\n".join(
-                f"- {point}" for point in explanation["key_evidence_points"]
-                ),
-
-                "confidence_in_insight": explanation["confidence_note"],
-
-                "summary_signal": summary_signal,
-            }
-        )
-
-    insight_df = pd.DataFrame(insights)
+    insight_df = derive_subject_insights(df)
 
     if insight_df.empty:
         raise RuntimeError("Phase 2 failed: no insights generated")
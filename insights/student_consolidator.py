@@ -21,13 +21,25 @@ Guarantees:
 """
 
 import os
-import json
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Optional
 
+import orjson
 import pandas as pd
 from dotenv import load_dotenv
 
+from llm.response_cache import cache_key, get_cached, put_cached
+from llm.retry import backoff_delay, is_rate_limited
+from llm.summary_generator import (
+    LLM_CONCURRENCY,
+    anthropic_client,
+    collect_json_stream,
+    gemini_model,
+    llm_providers,
+    openai_client,
+)
 from storage.google_sheets import (
     get_gs_client,
     get_spreadsheet,
@@ -43,7 +55,14 @@ from storage.google_sheets import (
 load_dotenv()
 
 MAX_RETRIES = 3
-RETRY_DELAY_SECONDS = 3
+
+# Caps in-flight requests per provider across all worker threads.
+# Ollama serializes requests server-side, so it gets a single slot.
+_LLM_SLOTS: Dict[str, threading.BoundedSemaphore] = {}
+_LLM_SLOTS_LOCK = threading.Lock()
+
+# upsert_table is read-modify-write; concurrent students must not interleave
+_SHEET_WRITE_LOCK = threading.Lock()
 
 # ============================================================
 # SYSTEM PROMPT (ASCII ONLY)
@@ -55,7 +74,9 @@ SYSTEM_PROMPT = (
     "Use ONLY provided data.\n"
     "Identify cross-subject patterns.\n"
     "Be concrete, structured, and professional.\n"
-    "Return ONLY valid JSON.\n"
+    "Return ONLY valid JSON with these keys:\n"
+    '{"overall_summary": "...", "key_strengths": "...", "areas_to_improve": "...", '
+    '"recommended_next_steps": "...", "confidence_note": "high | medium | low"}\n'
 )
 
 # ============================================================
@@ -68,7 +89,7 @@ def _require_env(var: str):
 
 def normalize_for_sheets(value) -> str:
     if isinstance(value, (dict, list)):
-        return json.dumps(value, ensure_ascii=False)
+        return orjson.dumps(value).decode("utf-8")
     if value is None:
         return ""
     return str(value)
@@ -77,13 +98,13 @@ def safe_json_parse(text: str) -> Optional[Dict]:
     if not text:
         return None
     try:
-        return json.loads(text)
+        return orjson.loads(text)
     except Exception:
         start = text.find("{")
         end = text.rfind("}")
         if start != -1 and end != -1 and end > start:
             try:
-                return json.loads(text[start:end + 1])
+                return orjson.loads(text[start:end + 1])
             except Exception:
                 return None
     return None
@@ -92,94 +113,105 @@ def safe_json_parse(text: str) -> Optional[Dict]:
 # PROMPT BUILDER
 # ============================================================
 
+def _compact_json(value) -> str:
+    # No indentation: whitespace only costs input tokens
+    return orjson.dumps(
+        value, option=orjson.OPT_SERIALIZE_NUMPY, default=str
+    ).decode()
+
 def build_prompt(
     student_id: str,
     grade: int,
     analytics: List[Dict],
     summaries: List[Dict],
 ) -> str:
+    # The JSON schema lives in SYSTEM_PROMPT; the user turn is only data
     return (
         f"Student ID: {student_id}\n"
         f"Grade: {grade}\n\n"
-        f"Numerical subject analytics:\n{json.dumps(analytics, indent=2)}\n\n"
-        f"Subject-level AI summaries:\n{json.dumps(summaries, indent=2)}\n\n"
-        "Return JSON ONLY in this exact schema:\n"
-        "{\n"
-        '  "overall_summary": "...",\n'
-        '  "key_strengths": "...",\n'
-        '  "areas_to_improve": "...",\n'
-        '  "recommended_next_steps": "...",\n'
-        '  "confidence_note": "high | medium | low"\n'
-        "}"
+        f"Numerical subject analytics:\n{_compact_json(analytics)}\n\n"
+        f"Subject-level AI summaries:\n{_compact_json(summaries)}"
     )
 
+def _llm_slots(provider: str) -> threading.BoundedSemaphore:
+    with _LLM_SLOTS_LOCK:
+        if provider not in _LLM_SLOTS:
+            limit = 1 if provider == "ollama" else max(LLM_CONCURRENCY, 1)
+            _LLM_SLOTS[provider] = threading.BoundedSemaphore(limit)
+        return _LLM_SLOTS[provider]
+
 # ============================================================
 # LLM BACKENDS (STRICT)
 # ============================================================
 
 def call_ollama(prompt: str) -> str:
     import ollama
-    r = ollama.chat(
+    stream = ollama.chat(
         model=os.getenv("OLLAMA_MODEL", "mistral"),
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ],
+        stream=True,
     )
-    return r["message"]["content"]
+    return collect_json_stream(chunk["message"]["content"] for chunk in stream)
 
 def call_openai(prompt: str) -> str:
     _require_env("OPENAI_API_KEY")
-    from openai import OpenAI
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    r = client.chat.completions.create(
+    client = openai_client(os.getenv("OPENAI_API_KEY"))
+    stream = client.chat.completions.create(
         model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ],
         temperature=0.3,
+        stream=True,
     )
-    return r.choices[0].message.content
+    with stream:
+        return collect_json_stream(
+            chunk.choices[0].delta.content for chunk in stream if chunk.choices
+        )
 
 def call_claude(prompt: str) -> str:
     _require_env("ANTHROPIC_API_KEY")
-    from anthropic import Anthropic
-    client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-    r = client.messages.create(
+    client = anthropic_client(os.getenv("ANTHROPIC_API_KEY"))
+    with client.messages.stream(
         model=os.getenv("CLAUDE_MODEL", "claude-3-haiku-20240307"),
         max_tokens=700,
         system=SYSTEM_PROMPT,
         messages=[{"role": "user", "content": prompt}],
-    )
-    return r.content[0].text
+    ) as stream:
+        return collect_json_stream(stream.text_stream)
 
 def call_gemini(prompt: str) -> str:
     _require_env("GEMINI_API_KEY")
-    import google.generativeai as genai
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    model = genai.GenerativeModel(
-        model_name=os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
-        system_instruction=SYSTEM_PROMPT,
+    model = gemini_model(
+        os.getenv("GEMINI_API_KEY"),
+        os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
+        SYSTEM_PROMPT,
     )
     return model.generate_content(prompt).text
 
 def call_deepseek(prompt: str) -> str:
     _require_env("DEEPSEEK_API_KEY")
-    from openai import OpenAI
-    client = OpenAI(
-        api_key=os.getenv("DEEPSEEK_API_KEY"),
+    client = openai_client(
+        os.getenv("DEEPSEEK_API_KEY"),
         base_url="https://api.deepseek.com",
     )
-    r = client.chat.completions.create(
+    stream = client.chat.completions.create(
         model=os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ],
         temperature=0.3,
+        stream=True,
     )
-    return r.choices[0].message.content
+    with stream:
+        return collect_json_stream(
+            chunk.choices[0].delta.content for chunk in stream if chunk.choices
+        )
 
 LLM_BACKENDS = {
     "ollama": call_ollama,
@@ -206,12 +238,26 @@ def generate_consolidated_summary(
 
     prompt = build_prompt(student_id, grade, analytics, summaries)
 
-    for _ in range(MAX_RETRIES):
-        raw = LLM_BACKENDS[llm_provider](prompt)
+    key = cache_key(llm_provider, SYSTEM_PROMPT, prompt)
+    cached = safe_json_parse(get_cached(key))
+    if cached:
+        return cached
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            with _llm_slots(llm_provider):
+                raw = LLM_BACKENDS[llm_provider](prompt)
+        except Exception as exc:
+            # Only rate limits are retried; other provider errors surface as before
+            if not is_rate_limited(exc) or attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(backoff_delay(attempt, rate_limited=True))
+            continue
         parsed = safe_json_parse(raw)
         if parsed:
+            put_cached(key, raw)
             return parsed
-        time.sleep(RETRY_DELAY_SECONDS)
+        # Unparseable output: resample straight away
 
     raise RuntimeError("LLM failed to produce valid JSON")
 
@@ -219,23 +265,30 @@ def generate_consolidated_summary(
 # PIPELINE ENTRY (SAFE, IDEMPOTENT)
 # ============================================================
 
-def run_student_consolidation(student_id: str) -> None:
-    llm_provider = os.getenv("LLM_PROVIDER", "ollama").lower()
-
-    client = get_gs_client()
-    spreadsheet = get_spreadsheet(client)
+def _split_by_student(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    if df.empty or "student_id" not in df.columns:
+        return {}
+    return dict(tuple(df.groupby("student_id", sort=False)))
 
-    analytics_df = read_table(spreadsheet, "subject_analytics")
-    summaries_df = read_table(spreadsheet, "subject_summaries")
 
+def build_student_consolidation(
+    student_id: str,
+    analytics_df: pd.DataFrame,
+    summaries_df: pd.DataFrame,
+    llm_provider: str,
+) -> Optional[Dict]:
+    """
+    One consolidated output row for a student, or None if the student has
+    no analytics or no summaries. Calls the LLM but does no sheet I/O.
+    """
     a = analytics_df[analytics_df["student_id"] == student_id]
     s = summaries_df[summaries_df["student_id"] == student_id]
 
     if a.empty or s.empty:
         print(f"SKIPPED | No data for student_id={student_id}")
-        return
+        return None
 
-    grade = int(a.iloc[0]["grade"])
+    grade = int(a["grade"].iat[0])
 
     consolidated = generate_consolidated_summary(
         student_id=student_id,
@@ -245,28 +298,124 @@ def run_student_consolidation(student_id: str) -> None:
         llm_provider=llm_provider,
     )
 
-    output_df = pd.DataFrame([{
+    return {
         "student_id": student_id,
         "grade": grade,
         **{k: normalize_for_sheets(v) for k, v in consolidated.items()},
         "llm_provider": llm_provider,
-    }])
-
-    append_table(
-        spreadsheet=spreadsheet,
-        table_name="student_consolidated_history",
-        df=output_df,
-    )
+    }
+
+def _write_consolidations(spreadsheet, output_df: pd.DataFrame) -> None:
+    with _SHEET_WRITE_LOCK:
+        append_table(
+            spreadsheet=spreadsheet,
+            table_name="student_consolidated_history",
+            df=output_df,
+        )
+
+        upsert_table(
+            spreadsheet=spreadsheet,
+            table_name="student_consolidated_latest",
+            df=output_df,
+            key_columns=["student_id"],
+        )
+
+def run_student_consolidation(
+    student_id: str,
+    spreadsheet=None,
+    analytics_df: Optional[pd.DataFrame] = None,
+    summaries_df: Optional[pd.DataFrame] = None,
+) -> None:
+    """
+    Frames and spreadsheet handle may be passed in by the caller
+    (already filtered to this student is fine); otherwise they are read here.
+    """
+    llm_provider = llm_providers()[0]
+
+    if spreadsheet is None:
+        client = get_gs_client()
+        spreadsheet = get_spreadsheet(client)
+
+    if analytics_df is None:
+        analytics_df = read_table(spreadsheet, "subject_analytics")
+    if summaries_df is None:
+        summaries_df = read_table(spreadsheet, "subject_summaries")
+
+    row = build_student_consolidation(student_id, analytics_df, summaries_df, llm_provider)
+    if row is None:
+        return
 
-    upsert_table(
-        spreadsheet=spreadsheet,
-        table_name="student_consolidated_latest",
-        df=output_df,
-        key_columns=["student_id"],
-    )
+    _write_consolidations(spreadsheet, pd.DataFrame([row]))
 
     print(f"Student consolidation complete | {student_id} | LLM={llm_provider}")
 
+def run_student_consolidations(
+    student_ids: List[str],
+    spreadsheet=None,
+    analytics_df: Optional[pd.DataFrame] = None,
+    summaries_df: Optional[pd.DataFrame] = None,
+) -> int:
+    """
+    Consolidates many students concurrently and returns how many were written.
+    With several providers in LLM_PROVIDER, students are assigned round-robin.
+
+    Both tables are read once here and each worker gets its own slice.
+    All rows are then written together: one history append and one latest
+    upsert for the whole batch instead of two writes per student.
+    Students that succeeded are still written if another one fails.
+    """
+    providers = llm_providers()
+    # Per-provider slots in generate_consolidated_summary do the real limiting
+    workers = sum(1 if p == "ollama" else LLM_CONCURRENCY for p in providers)
+
+    if spreadsheet is None:
+        client = get_gs_client()
+        spreadsheet = get_spreadsheet(client)
+
+    if analytics_df is None:
+        analytics_df = read_table(spreadsheet, "subject_analytics")
+    if summaries_df is None:
+        summaries_df = read_table(spreadsheet, "subject_summaries")
+
+    analytics_by_id = _split_by_student(analytics_df)
+    summaries_by_id = _split_by_student(summaries_df)
+    empty = pd.DataFrame(columns=["student_id"])
+
+    rows: Dict[str, Dict] = {}
+    first_error: Optional[BaseException] = None
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = {
+            pool.submit(
+                build_student_consolidation,
+                sid,
+                analytics_by_id.get(sid, empty),
+                summaries_by_id.get(sid, empty),
+                providers[n % len(providers)],
+            ): sid
+            for n, sid in enumerate(student_ids)
+        }
+        for future in as_completed(futures):
+            sid = futures[future]
+            try:
+                row = future.result()
+            except Exception as exc:
+                print(f"FAILED | student_id={sid} | {type(exc).__name__}: {exc}")
+                first_error = first_error or exc
+                continue
+            if row is not None:
+                rows[sid] = row
+                print(f"Student consolidation complete | {sid} | LLM={row['llm_provider']}")
+
+    if rows:
+        # Keep the caller's student order rather than completion order
+        output_df = pd.DataFrame([rows[sid] for sid in student_ids if sid in rows])
+        _write_consolidations(spreadsheet, output_df)
+
+    if first_error is not None:
+        raise first_error
+
+    return len(rows)
+
 # ============================================================
 # LOCAL TEST
 # ============================================================
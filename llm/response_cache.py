@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+LLM RESPONSE CACHE
+==================
+
+Exact-match, on-disk cache of raw LLM responses.
+
+Key = SHA-256 of (provider, model, system prompt, user prompt), so any
+change to the template, model or input data is a miss. Only responses
+that parsed as valid JSON are stored by callers, so a bad generation is
+never pinned.
+
+Set LLM_CACHE_DIR="" to disable.
+"""
+
+import os
+import hashlib
+import threading
+from typing import Optional
+
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".cache/llm")
+
+
+def cache_key(provider: str, system_prompt: str, prompt: str) -> str:
+    # Every backend reads its model from <PROVIDER>_MODEL
+    model = os.getenv(f"{provider.upper()}_MODEL", "")
+    h = hashlib.sha256()
+    for part in (provider, model, system_prompt, prompt):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def get_cached(key: str) -> Optional[str]:
+    if not LLM_CACHE_DIR:
+        return None
+    try:
+        with open(os.path.join(LLM_CACHE_DIR, f"{key}.txt"), encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def put_cached(key: str, response: str) -> None:
+    if not LLM_CACHE_DIR:
+        return
+    path = os.path.join(LLM_CACHE_DIR, f"{key}.txt")
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        # Writers run on worker threads; keep temp names distinct
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(response)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
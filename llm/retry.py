@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+"""
+LLM RETRY POLICY
+================
+
+Shared by Phase 3 and Phase 4 provider calls.
+
+- Unparseable output: retry straight away (the next sample is independent).
+- Rate limits / transient errors: exponential backoff with full jitter, so
+  parallel workers that hit a 429 together do not retry in lockstep.
+"""
+
+import random
+
+RETRY_BASE_SECONDS = 2
+RETRY_MAX_SECONDS = 30
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    # openai / anthropic expose .status_code, google.api_core exposes .code
+    return 429 in (getattr(exc, "status_code", None), getattr(exc, "code", None))
+
+
+def backoff_delay(attempt: int, rate_limited: bool = False) -> float:
+    """Seconds to wait before retry number `attempt` (0-based)."""
+    base = RETRY_BASE_SECONDS * (4 if rate_limited else 1)
+    return random.uniform(0, min(RETRY_MAX_SECONDS, base * 2 ** attempt))
@@ -1,13 +1,17 @@
 ﻿# -*- coding: utf-8 -*-
 
 import os
-import json
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import orjson
 import pandas as pd
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional
 
 from dotenv import load_dotenv
 
+from llm.response_cache import cache_key, get_cached, put_cached
+from llm.retry import backoff_delay, is_rate_limited
 from storage.google_sheets import (
     get_gs_client,
     get_spreadsheet,
@@ -22,20 +26,29 @@ from storage.google_sheets import (
 load_dotenv()
 
 MAX_RETRIES = 3
-RETRY_DELAY_SECONDS = 3
+
+# Rows (Phase 3) and students (Phase 4) processed in parallel;
+# provider calls are I/O-bound.
+# Ollama serializes requests server-side, so it always runs one at a time.
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+
+# LLM_BATCH_MODE=1 sends Phase 3 through the provider's batch API
+# (OpenAI / Claude only): half price, results within 24h
+BATCH_POLL_SECONDS = int(os.getenv("LLM_BATCH_POLL_SECONDS", "30"))
 
 # ============================================================
 # SYSTEM PROMPT (WORLD-CLASS, UI-READY)
 # ============================================================
 
 SYSTEM_PROMPT = (
-    "You are a senior academic mentor writing faculty-grade feedback.\n"
-    "Your tone must be calm, encouraging, and constructive.\n"
-    "Write in complete, well-structured paragraphs.\n"
-    "Explain performance clearly without inventing data.\n"
-    "Avoid short or robotic sentences.\n"
-    "Assume the output will be read by students, parents, and teachers.\n"
-    "Return ONLY valid JSON.\n"
+    "You are a senior academic mentor writing feedback for students, parents and teachers.\n"
+    "Be calm, encouraging and constructive, in complete, well-structured sentences.\n"
+    "Explain the performance pattern clearly; never invent data.\n"
+    "Return ONLY valid JSON with these keys:\n"
+    '{"performance_summary": "2-4 sentences on current performance and pattern", '
+    '"improvement_plan": "concrete, actionable guidance, not commands", '
+    '"motivation_note": "encouraging, growth-mindset message", '
+    '"confidence_note": "high | medium | low"}\n'
 )
 
 # ============================================================
@@ -46,50 +59,78 @@ def safe_json_parse(text: str) -> Optional[Dict]:
     if not text:
         return None
     try:
-        return json.loads(text)
+        return orjson.loads(text)
     except Exception:
         start = text.find("{")
         end = text.rfind("}")
         if start != -1 and end != -1 and end > start:
             try:
-                return json.loads(text[start:end + 1])
+                return orjson.loads(text[start:end + 1])
             except Exception:
                 return None
     return None
 
+def collect_json_stream(pieces: Iterable[str]) -> str:
+    """
+    Join streamed text pieces, stopping as soon as the first top-level
+    {...} object is complete and parses, so whatever the model writes
+    after it is never generated or downloaded. If no object ever closes
+    cleanly the whole stream is read, as without streaming.
+    """
+    parts = []
+    seen = 0            # characters consumed so far
+    depth = 0
+    start = 0           # offset of the current top-level "{"
+    in_string = escaped = False
+    for piece in pieces:
+        if not piece:
+            continue
+        parts.append(piece)
+        for offset, ch in enumerate(piece, start=seen):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = depth > 0
+            elif ch == "{":
+                if depth == 0:
+                    start = offset
+                depth += 1
+            elif ch == "}" and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    text = "".join(parts)[:offset + 1]
+                    if safe_json_parse(text[start:]) is not None:
+                        return text
+        seen += len(piece)
+    return "".join(parts)
+
 # ============================================================
 # PROMPT BUILDER
 # ============================================================
 
+# Instructions and the JSON shape live in SYSTEM_PROMPT (identical on every
+# call, so provider prompt caching can reuse it); the user turn is only the
+# row's facts, one short line each.
+_PROMPT_FMT = (
+    "Grade: %(grade)s\n"
+    "Subject: %(subject)s\n"
+    "Primary issue: %(primary_issue)s\n"
+    "Secondary issue: %(secondary_issue)s\n"
+    "Root cause: %(root_cause_category)s\n"
+    "Risk level: %(academic_risk_level)s\n"
+    "Urgency: %(urgency_level)s\n"
+    "Focus area: %(recommended_focus_area)s\n"
+    "Teacher intervention needed: %(teacher_intervention_needed)s"
+)
+
 def build_prompt(row: Dict) -> str:
-    return f"""
-Student Academic Context
-------------------------
-Grade: {row['grade']}
-Subject: {row['subject']}
-
-Interpretable Insights
----------------------
-Primary issue: {row['primary_issue']}
-Secondary issue: {row['secondary_issue']}
-Root cause category: {row['root_cause_category']}
-Academic risk level: {row['academic_risk_level']}
-Urgency level: {row['urgency_level']}
-Recommended focus area: {row['recommended_focus_area']}
-Teacher intervention needed: {row['teacher_intervention_needed']}
-
-Instructions
-------------
-Write a detailed but readable academic summary.
-
-Return ONLY valid JSON in the following structure:
-{{
-  "performance_summary": "2–4 sentences explaining current performance and pattern",
-  "improvement_plan": "Concrete, actionable steps written as guidance, not commands",
-  "motivation_note": "Encouraging message focused on confidence and growth mindset",
-  "confidence_note": "high | medium | low"
-}}
-"""
+    # One C-level format over the row dict; no per-field Python work
+    return _PROMPT_FMT % row
 
 # ============================================================
 # API KEY RESOLVER
@@ -106,6 +147,32 @@ def _get_api_key(env_var: str) -> Optional[str]:
         pass
     return os.getenv(env_var)
 
+# ============================================================
+# SDK CLIENTS (ONE PER KEY, SHARED ACROSS CALLS AND THREADS)
+# Keeps each provider's connection pool warm instead of a
+# new TLS handshake per row. Phase 4 imports these too, so
+# each process holds one pool per key.
+# ============================================================
+
+@lru_cache(maxsize=None)
+def openai_client(api_key: str, base_url: Optional[str] = None):
+    from openai import OpenAI
+    return OpenAI(api_key=api_key, base_url=base_url)
+
+@lru_cache(maxsize=None)
+def anthropic_client(api_key: str):
+    from anthropic import Anthropic
+    return Anthropic(api_key=api_key)
+
+@lru_cache(maxsize=None)
+def gemini_model(api_key: str, model_name: str, system_prompt: str):
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(
+        model_name=model_name,
+        system_instruction=system_prompt,
+    )
+
 # ============================================================
 # LLM BACKENDS
 # ============================================================
@@ -118,63 +185,78 @@ def call_ollama(prompt: str) -> str:
             "Please select Claude, OpenAI, Gemini, or DeepSeek."
         )
     import ollama
-    r = ollama.chat(
+    stream = ollama.chat(
         model=os.getenv("OLLAMA_MODEL", "mistral"),
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ],
+        stream=True,
     )
-    return r["message"]["content"]
+    return collect_json_stream(chunk["message"]["content"] for chunk in stream)
 
 def call_openai(prompt: str, api_key: str = None) -> str:
-    from openai import OpenAI
-    client = OpenAI(api_key=api_key or _get_api_key("OPENAI_API_KEY"))
-    r = client.chat.completions.create(
+    client = openai_client(api_key or _get_api_key("OPENAI_API_KEY"))
+    stream = client.chat.completions.create(
         model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ],
         temperature=0.4,
+        stream=True,
     )
-    return r.choices[0].message.content
+    with stream:
+        return collect_json_stream(
+            chunk.choices[0].delta.content for chunk in stream if chunk.choices
+        )
 
 def call_claude(prompt: str, api_key: str = None) -> str:
-    from anthropic import Anthropic
-    client = Anthropic(api_key=api_key or _get_api_key("ANTHROPIC_API_KEY"))
-    r = client.messages.create(
+    client = anthropic_client(api_key or _get_api_key("ANTHROPIC_API_KEY"))
+    with client.messages.stream(
         model=os.getenv("CLAUDE_MODEL", "claude-3-haiku-20240307"),
         max_tokens=700,
         system=SYSTEM_PROMPT,
         messages=[{"role": "user", "content": prompt}],
-    )
-    return r.content[0].text
+    ) as stream:
+        return collect_json_stream(stream.text_stream)
 
 def call_gemini(prompt: str, api_key: str = None) -> str:
-    import google.generativeai as genai
-    genai.configure(api_key=api_key or _get_api_key("GEMINI_API_KEY"))
-    model = genai.GenerativeModel(
-        model_name=os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
-        system_instruction=SYSTEM_PROMPT,
+    model = gemini_model(
+        api_key or _get_api_key("GEMINI_API_KEY"),
+        os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
+        SYSTEM_PROMPT,
     )
     return model.generate_content(prompt).text
 
 def call_deepseek(prompt: str, api_key: str = None) -> str:
-    from openai import OpenAI
-    client = OpenAI(
-        api_key=api_key or _get_api_key("DEEPSEEK_API_KEY"),
+    client = openai_client(
+        api_key or _get_api_key("DEEPSEEK_API_KEY"),
         base_url="https://api.deepseek.com",
     )
-    r = client.chat.completions.create(
+    stream = client.chat.completions.create(
         model=os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ],
         temperature=0.4,
+        stream=True,
     )
-    return r.choices[0].message.content
+    with stream:
+        return collect_json_stream(
+            chunk.choices[0].delta.content for chunk in stream if chunk.choices
+        )
+
+def llm_providers(value: str = None) -> List[str]:
+    """
+    LLM_PROVIDER may name several providers ("openai,gemini,deepseek").
+    Work is then sharded round-robin across them, each with its own
+    rate-limit budget.
+    """
+    value = value or os.getenv("LLM_PROVIDER", "ollama")
+    providers = [p.strip().lower() for p in value.split(",") if p.strip()]
+    return providers or ["ollama"]
 
 def call_llm(prompt: str, provider: str = None, api_key: str = None) -> str:
     provider = (provider or os.getenv("LLM_PROVIDER", "ollama")).lower()
@@ -196,6 +278,98 @@ def call_llm(prompt: str, provider: str = None, api_key: str = None) -> str:
         return call_deepseek(prompt, api_key=api_key)
     raise ValueError(f"Unsupported LLM_PROVIDER: {provider}")
 
+# ============================================================
+# BATCH BACKENDS
+# Each returns one raw response per prompt, in order.
+# Items the provider failed come back as None.
+# ============================================================
+
+def call_openai_batch(prompts: List[str], api_key: str = None) -> List[Optional[str]]:
+    client = openai_client(api_key or _get_api_key("OPENAI_API_KEY"))
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+    lines = [
+        orjson.dumps({
+            "custom_id": f"row-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt},
+                ],
+                "temperature": 0.4,
+            },
+        })
+        for i, prompt in enumerate(prompts)
+    ]
+    batch_file = client.files.create(
+        file=("subject_summaries.jsonl", b"\n".join(lines)),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = client.batches.retrieve(batch.id)
+
+    results: List[Optional[str]] = [None] * len(prompts)
+    if not batch.output_file_id:
+        print(f"OpenAI batch {batch.id} ended as {batch.status} with no output")
+        return results
+
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line:
+            continue
+        item = orjson.loads(line)
+        response = item.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        i = int(item["custom_id"].split("-", 1)[1])
+        results[i] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+def call_claude_batch(prompts: List[str], api_key: str = None) -> List[Optional[str]]:
+    client = anthropic_client(api_key or _get_api_key("ANTHROPIC_API_KEY"))
+    model = os.getenv("CLAUDE_MODEL", "claude-3-haiku-20240307")
+
+    batch = client.messages.batches.create(
+        requests=[
+            {
+                "custom_id": f"row-{i}",
+                "params": {
+                    "model": model,
+                    "max_tokens": 700,
+                    "system": SYSTEM_PROMPT,
+                    "messages": [{"role": "user", "content": prompt}],
+                },
+            }
+            for i, prompt in enumerate(prompts)
+        ]
+    )
+
+    while batch.processing_status != "ended":
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = client.messages.batches.retrieve(batch.id)
+
+    results: List[Optional[str]] = [None] * len(prompts)
+    for entry in client.messages.batches.results(batch.id):
+        if entry.result.type != "succeeded":
+            continue
+        i = int(entry.custom_id.split("-", 1)[1])
+        results[i] = entry.result.message.content[0].text
+    return results
+
+LLM_BATCH_BACKENDS = {
+    "openai": call_openai_batch,
+    "claude": call_claude_batch,
+}
+
 # ============================================================
 # SUMMARY GENERATION
 # ============================================================
@@ -203,15 +377,25 @@ def call_llm(prompt: str, provider: str = None, api_key: str = None) -> str:
 def generate_summary(row: Dict, provider: str = None, api_key: str = None) -> Dict:
     prompt = build_prompt(row)
 
-    for _ in range(MAX_RETRIES):
+    provider = (provider or os.getenv("LLM_PROVIDER", "ollama")).lower()
+    key = cache_key(provider, SYSTEM_PROMPT, prompt)
+    cached = safe_json_parse(get_cached(key))
+    if cached:
+        return cached
+
+    for attempt in range(MAX_RETRIES):
         try:
             raw = call_llm(prompt, provider=provider, api_key=api_key)
-            parsed = safe_json_parse(raw)
-            if parsed:
-                return parsed
         except Exception as exc:
             print(f"LLM call failed ({type(exc).__name__}: {exc}), retrying...")
-        time.sleep(RETRY_DELAY_SECONDS)
+            if attempt < MAX_RETRIES - 1:
+                time.sleep(backoff_delay(attempt, rate_limited=is_rate_limited(exc)))
+            continue
+        parsed = safe_json_parse(raw)
+        if parsed:
+            put_cached(key, raw)
+            return parsed
+        # Unparseable output: resample straight away
 
     return {
         "performance_summary": (
@@ -235,7 +419,7 @@ def generate_summary(row: Dict, provider: str = None, api_key: str = None) -> Di
 # ============================================================
 
 def run_llm():
-    provider = os.getenv("LLM_PROVIDER", "ollama").lower()
+    providers = llm_providers()
 
     client = get_gs_client()
     spreadsheet = get_spreadsheet(client)
@@ -247,11 +431,59 @@ def run_llm():
     if df.empty:
         raise RuntimeError("subject_insights sheet is empty")
 
+    rows = df.to_dict(orient="records")
     summaries = []
 
-    for row in df.to_dict(orient="records"):
-        summary = generate_summary(row)
-
+    # The prompt carries no student identity, so rows with the same grade,
+    # subject and insight profile produce the same prompt; ask once per prompt
+    prompts = [build_prompt(row) for row in rows]
+    first_row: Dict[str, Dict] = {}
+    for row, prompt in zip(rows, prompts):
+        first_row.setdefault(prompt, row)
+    unique = list(first_row)
+    assigned = [providers[i % len(providers)] for i in range(len(unique))]
+
+    batch_raw: List[Optional[str]] = [None] * len(unique)
+    if os.getenv("LLM_BATCH_MODE") == "1":
+        # Only prompts without a cached response go into a batch
+        keys = [cache_key(p, SYSTEM_PROMPT, prompt) for p, prompt in zip(assigned, unique)]
+        batch_raw = [get_cached(key) for key in keys]
+        for provider in providers:
+            if provider not in LLM_BATCH_BACKENDS:
+                continue
+            pending = [
+                i for i, raw in enumerate(batch_raw)
+                if assigned[i] == provider and not safe_json_parse(raw)
+            ]
+            if not pending:
+                continue
+            answers = LLM_BATCH_BACKENDS[provider]([unique[i] for i in pending])
+            for i, raw in zip(pending, answers):
+                batch_raw[i] = raw
+                if safe_json_parse(raw):
+                    put_cached(keys[i], raw)
+
+    def summarize(i: int) -> Dict:
+        # Prompts the batch could not answer fall back to a direct call
+        summary = safe_json_parse(batch_raw[i])
+        return summary or generate_summary(first_row[unique[i]], provider=assigned[i])
+
+    # One pool per provider so each keeps its own concurrency limit
+    pools = {
+        provider: ThreadPoolExecutor(
+            max_workers=1 if provider == "ollama" else max(LLM_CONCURRENCY, 1)
+        )
+        for provider in set(assigned)
+    }
+    try:
+        futures = [pools[assigned[i]].submit(summarize, i) for i in range(len(unique))]
+        results = {prompt: (f.result(), p) for prompt, f, p in zip(unique, futures, assigned)}
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+
+    for row, prompt in zip(rows, prompts):
+        summary, provider = results[prompt]
         summaries.append({
             "student_id": row["student_id"],
             "grade": row["grade"],
@@ -24,7 +24,6 @@ Example:
 from datetime import datetime, timezone
 import sys
 import os
-import time
 import traceback
 
 # ============================================================
@@ -35,12 +34,12 @@ from analytics.validators import run_validation
 from analytics.student_analyzer import analyze_students
 from insights.insight_engine import derive_insights
 from llm.summary_generator import run_llm
-from insights.student_consolidator import run_student_consolidation
+from insights.student_consolidator import run_student_consolidations
 
 from storage.google_sheets import (
     get_gs_client,
     get_spreadsheet,
-    read_table,
+    read_tables,
 )
 
 # ============================================================
@@ -118,8 +117,9 @@ def run_full_pipeline(llm_provider: str, llm_row_limit: int):
         client = get_gs_client()
         spreadsheet = get_spreadsheet(client)
 
-        analytics_df = read_table(spreadsheet, "subject_analytics")
-        summaries_df = read_table(spreadsheet, "subject_summaries")
+        tables = read_tables(spreadsheet, ["subject_analytics", "subject_summaries"])
+        analytics_df = tables["subject_analytics"]
+        summaries_df = tables["subject_summaries"]
 
         if analytics_df.empty:
             raise RuntimeError("subject_analytics sheet is empty")
@@ -136,11 +136,12 @@ def run_full_pipeline(llm_provider: str, llm_row_limit: int):
 
         log(f"PHASE 4 | Students with summaries ready: {len(student_ids)}")
 
-        consolidated = 0
-        for sid in student_ids:
-            run_student_consolidation(sid)
-            consolidated += 1
-            time.sleep(2)  # respect Google Sheets read-quota between students
+        consolidated = run_student_consolidations(
+            student_ids,
+            spreadsheet=spreadsheet,
+            analytics_df=analytics_df,
+            summaries_df=summaries_df,
+        )
 
         log(f"PHASE 4 | SUCCESS | Students consolidated: {consolidated}")
 
@@ -170,24 +171,9 @@ def run_pipeline_for_student(student_id: str, llm_provider: str = "ollama"):
     import pandas as pd
 
     from analytics.validators import coerce_types, validate_schema, validate_rows
-    from analytics.metrics import (
-        calculate_trend,
-        improvement_velocity,
-        consistency_score,
-        mock_vs_real_gap,
-        performance_band,
-        volatility_level,
-        recent_average,
-        risk_flag,
-        data_confidence,
-    )
-    from insights.insight_engine import (
-        derive_primary_issue,
-        derive_secondary_issue,
-        derive_focus_area,
-        build_explanation,
-    )
-    from llm.summary_generator import generate_summary
+    from analytics.metrics import subject_metrics
+    from insights.insight_engine import derive_subject_insights
+    from llm.summary_generator import generate_summary, llm_providers
     from insights.student_consolidator import run_student_consolidation
     from storage.google_sheets import (
         get_gs_client,
@@ -235,36 +221,9 @@ def run_pipeline_for_student(student_id: str, llm_provider: str = "ollama"):
     sv = sv.dropna(subset=["student_id", "subject", "score", "exam_date"])
     sv = sv.sort_values("exam_date")
 
-    analytics_rows = []
-    for (s_id, grade, subject), grp in sv.groupby(
-        ["student_id", "grade", "subject"], dropna=True
-    ):
-        scores = grp["score"].astype(float)
-        if scores.empty or scores.isna().all():
-            continue
-        _trend = calculate_trend(scores)
-        _avg = round(float(scores.mean()), 2)
-        analytics_rows.append({
-            "student_id":           s_id,
-            "grade":                int(grade),
-            "subject":              subject,
-            "attempt_count":        len(scores),
-            "average_score":        _avg,
-            "latest_score":         float(scores.iloc[-1]),
-            "recent_avg_score":     recent_average(scores),
-            "trend":                _trend,
-            "improvement_velocity": improvement_velocity(scores),
-            "consistency_score":    consistency_score(scores),
-            "volatility_level":     volatility_level(scores),
-            "mock_vs_real_gap":     mock_vs_real_gap(grp),
-            "performance_band":     performance_band(_avg),
-            "risk_flag":            risk_flag(_avg, _trend),
-            "data_confidence_level": data_confidence(len(scores)),
-        })
-
-    if not analytics_rows:
+    analytics_df = subject_metrics(sv)
+    if analytics_df.empty:
         raise ValueError(f"No analytics generated for {sid}")
-    analytics_df = pd.DataFrame(analytics_rows)
     upsert_table(
         spreadsheet, "subject_analytics", analytics_df,
         key_columns=["student_id", "subject"],
@@ -281,38 +240,9 @@ def run_pipeline_for_student(student_id: str, llm_provider: str = "ollama"):
     )
     analytics_df = analytics_df.dropna(subset=["average_score"])
 
-    insight_rows = []
-    for row in analytics_df.itertuples(index=False):
-        primary_issue, root_cause, urgency = derive_primary_issue(
-            row.average_score, row.trend
-        )
-        secondary_issue = derive_secondary_issue(row.volatility_level, row.mock_vs_real_gap)
-        focus_area = derive_focus_area(urgency)
-        explanation = build_explanation(row, primary_issue)
-        insight_rows.append({
-            "student_id":                  row.student_id,
-            "grade":                       int(row.grade),
-            "subject":                     row.subject,
-            "primary_issue":               primary_issue,
-            "secondary_issue":             secondary_issue,
-            "root_cause_category":         root_cause,
-            "academic_risk_level":         row.risk_flag,
-            "urgency_level":               urgency,
-            "recommended_focus_area":      focus_area,
-            "teacher_intervention_needed": "yes" if urgency == "high" else "no",
-            "explanation_summary":         explanation["explanation_summary"],
-            "key_evidence_points":         "\n".join(
-                f"- {p}" for p in explanation["key_evidence_points"]
-            ),
-            "confidence_in_insight":       explanation["confidence_note"],
-            "summary_signal": (
-                f"{row.performance_band} performer with {row.risk_flag} risk"
-            ),
-        })
-
-    if not insight_rows:
+    insight_df = derive_subject_insights(analytics_df)
+    if insight_df.empty:
         raise ValueError(f"No insights generated for {sid}")
-    insight_df = pd.DataFrame(insight_rows)
     upsert_table(
         spreadsheet, "subject_insights", insight_df,
         key_columns=["student_id", "subject"],
@@ -321,9 +251,11 @@ def run_pipeline_for_student(student_id: str, llm_provider: str = "ollama"):
 
     # ── PHASE 3: LLM SUMMARIES ───────────────────────────────────────
     log(f"PHASE 3 | Generating LLM summaries for {sid}")
+    providers = llm_providers(llm_provider)
     summary_rows = []
-    for row in insight_df.to_dict(orient="records"):
-        summary = generate_summary(row, provider=llm_provider)
+    for n, row in enumerate(insight_df.to_dict(orient="records")):
+        provider = providers[n % len(providers)]
+        summary = generate_summary(row, provider=provider)
         summary_rows.append({
             "student_id":        sid,
             "grade":             row["grade"],
@@ -332,7 +264,7 @@ def run_pipeline_for_student(student_id: str, llm_provider: str = "ollama"):
             "improvement_plan":  summary.get("improvement_plan", ""),
             "motivation_note":   summary.get("motivation_note", ""),
             "confidence_note":   summary.get("confidence_note", "low"),
-            "llm_provider":      llm_provider,
+            "llm_provider":      provider,
         })
 
     if not summary_rows:
@@ -346,7 +278,13 @@ def run_pipeline_for_student(student_id: str, llm_provider: str = "ollama"):
 
     # ── PHASE 4: CONSOLIDATION ────────────────────────────────────────
     log(f"PHASE 4 | Consolidating report for {sid}")
-    run_student_consolidation(sid)
+    # This student's analytics and summaries are already in memory
+    run_student_consolidation(
+        sid,
+        spreadsheet=spreadsheet,
+        analytics_df=analytics_df,
+        summaries_df=summaries_df,
+    )
     log(f"PHASE 4 | SUCCESS")
     log(f"Per-student pipeline COMPLETE | {sid}")
 
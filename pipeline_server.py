@@ -1,18 +1,21 @@
 ﻿# -*- coding: utf-8 -*-
 
 from fastapi import FastAPI, HTTPException, Body
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 import os
-import json
+import orjson
 import threading
+import time
 import uuid as _uuid
 import pandas as pd
 from typing import Any, Optional
 
 from storage.google_sheets import (
+    SHEET_STR_DTYPE,
     get_gs_client,
     get_spreadsheet,
-    read_table,
+    read_tables,
 )
 
 from insights.student_consolidator import generate_consolidated_summary
@@ -25,6 +28,7 @@ app = FastAPI(
     title="AI Student Intelligence API",
     description="Production-grade hybrid academic intelligence service",
     version="2.5.1",
+    default_response_class=ORJSONResponse,
 )
 
 # In-memory pipeline job registry
@@ -51,71 +55,152 @@ class PipelineRunRequest(BaseModel):
 # NORMALIZATION HELPERS
 # =====================================================
 
+# orjson.loads can only succeed on text starting with one of these
+# (object, array, string, number, true/false/null)
+_JSON_START = frozenset('{["-0123456789tfn')
+
+
 def normalize(value: Any):
-    if value is None:
-        return ""
-    if isinstance(value, float) and pd.isna(value):
-        return ""
-    if isinstance(value, (list, dict)):
-        return value
-    if isinstance(value, str):
+    # Sheet cells are nearly always str, so that branch is tested first
+    if type(value) is str:
         v = value.strip()
+        if not v or v[0] not in _JSON_START:
+            return v
         try:
-            return json.loads(v)
-        except Exception:
+            return orjson.loads(v)
+        except orjson.JSONDecodeError:
             return v
+    if value is None or value is pd.NA:
+        return ""
+    # NaN is the only float unequal to itself
+    if isinstance(value, float) and value != value:
+        return ""
+    if isinstance(value, str):
+        return normalize(str(value))
     return value
 
 
 def normalize_student_id(df: pd.DataFrame) -> pd.DataFrame:
     if df is None or df.empty or "student_id" not in df.columns:
         return df
-    df = df.copy()
-    df["student_id"] = df["student_id"].astype(str).str.strip()
+    # Modified in place: callers pass frames fresh from read_tables
+    # Arrow-backed strings: strip, compare and group run in C, not per object
+    df["student_id"] = df["student_id"].astype(SHEET_STR_DTYPE).str.strip()
     return df
 
 
 def df_to_records(df: pd.DataFrame):
     if df is None or df.empty:
         return []
-    records = json.loads(df.to_json(orient="records"))
-    return [{k: normalize(v) for k, v in row.items()} for row in records]
+    values = []
+    for _, col in df.items():
+        if pd.api.types.is_numeric_dtype(col.dtype):
+            # Numbers never hold JSON text; only missing cells need mapping
+            values.append(col.astype(object).where(col.notna(), "").tolist())
+        else:
+            values.append([normalize(v) for v in col.tolist()])
+    cols = list(df.columns)
+    return [dict(zip(cols, row)) for row in zip(*values)]
 
 # =====================================================
 # DATA LOADERS (SAFE)
+# Tables only change when a pipeline run writes them, so
+# they are held in memory for SHEETS_TTL seconds and
+# pre-split by student_id. Cached payloads built from a
+# table generation are kept until that generation goes.
+# Finished pipeline jobs and POST /cache/invalidate drop
+# the cache immediately.
 # =====================================================
 
-def load_tables():
+SHEETS_TTL = int(os.getenv("SHEETS_TTL", "60"))
+
+TABLE_NAMES = (
+    "subject_analytics",
+    "subject_summaries",
+    "subject_insights",
+    "student_consolidated_latest",
+    "validated_results",
+)
+
+_table_cache: dict = {"loaded_at": 0.0, "tables": None, "by_student": None, "payloads": {}}
+_table_cache_lock = threading.Lock()
+
+
+def _index_by_student(df: pd.DataFrame) -> dict:
+    if df is None or df.empty or "student_id" not in df.columns:
+        return {}
+    return dict(tuple(df.groupby("student_id", sort=False)))
+
+
+def _fetch_tables() -> dict:
     client = get_gs_client()
     sheet = get_spreadsheet(client)
+    # All five tabs in one Sheets round trip
+    tables = read_tables(sheet, TABLE_NAMES)
+    tables = {name: normalize_student_id(df) for name, df in tables.items()}
+
+    # Sorted once here so every student's analytics slice is already in subject order
+    analytics = tables["subject_analytics"]
+    if "subject" in analytics.columns:
+        tables["subject_analytics"] = analytics.sort_values("subject", kind="stable")
+    return tables
+
+
+def _cached_tables():
+    # Held while fetching so concurrent misses share one Sheets read
+    with _table_cache_lock:
+        age = time.monotonic() - _table_cache["loaded_at"]
+        if _table_cache["tables"] is None or age > SHEETS_TTL:
+            tables = _fetch_tables()
+            _table_cache["tables"] = tables
+            _table_cache["by_student"] = {
+                name: _index_by_student(df) for name, df in tables.items()
+            }
+            _table_cache["payloads"] = {}
+            _table_cache["loaded_at"] = time.monotonic()
+        return _table_cache["tables"], _table_cache["by_student"]
+
+
+def invalidate_table_cache():
+    with _table_cache_lock:
+        _table_cache["tables"] = None
+        _table_cache["by_student"] = None
+        _table_cache["payloads"] = {}
 
-    analytics = normalize_student_id(read_table(sheet, "subject_analytics"))
-    summaries = normalize_student_id(read_table(sheet, "subject_summaries"))
-    insights = normalize_student_id(read_table(sheet, "subject_insights"))
-    consolidated = normalize_student_id(read_table(sheet, "student_consolidated_latest"))
-    validated = normalize_student_id(read_table(sheet, "validated_results"))
 
-    return analytics, summaries, insights, consolidated, validated
+def load_tables():
+    tables, _ = _cached_tables()
+    return tuple(tables[name] for name in TABLE_NAMES)
 
 
-def get_student_metadata(validated: pd.DataFrame, student_id: str):
-    sid = student_id.strip()
+def student_rows(table_name: str, student_id: str) -> pd.DataFrame:
+    """One student's rows of a cached table (empty frame with the table's columns if none)."""
+    tables, by_student = _cached_tables()
+    return by_student[table_name].get(student_id, tables[table_name].iloc[:0])
 
-    if validated is None or validated.empty:
-        return {"student_name": "", "grade": ""}
 
-    row = validated[validated["student_id"] == sid]
-    if row.empty:
+def _first(df: pd.DataFrame, column: str, default=None):
+    """First value of a column, read without materializing a row Series."""
+    return df[column].iat[0] if column in df.columns else default
+
+
+def _column(df: pd.DataFrame, column: str) -> list:
+    """Column values as a list (all None if the sheet has no such column)."""
+    return df[column].tolist() if column in df.columns else [None] * len(df)
+
+
+def get_student_metadata(student_id: str):
+    rows = student_rows("validated_results", student_id.strip())
+    if rows.empty:
         return {"student_name": "", "grade": ""}
 
-    r = row.iloc[0]
-    grade_raw = r.get("grade")
+    grade_raw = _first(rows, "grade")
     try:
         grade_val = int(grade_raw)
     except (TypeError, ValueError):
         grade_val = ""
     return {
-        "student_name": normalize(r.get("Name", "")),
+        "student_name": normalize(_first(rows, "Name", "")),
         "grade": grade_val,
     }
 
@@ -123,20 +208,36 @@ def get_student_metadata(validated: pd.DataFrame, student_id: str):
 # CACHED FLOW
 # =====================================================
 
+def _payload_cache() -> dict:
+    """Built /student-summary bodies for the current table generation."""
+    _cached_tables()
+    return _table_cache["payloads"]
+
+
 def load_cached(student_id: str):
-    analytics, summaries, insights, consolidated, validated = load_tables()
     sid = student_id.strip()
 
+    # Fetched before the tables: a refresh in between only drops what we store
+    payloads = _payload_cache()
+    payload = payloads.get(sid)
+    if payload is None:
+        payload = payloads[sid] = _build_cached_payload(sid)
+    return payload
+
+
+def _build_cached_payload(sid: str):
+    analytics, summaries, insights, consolidated, validated = load_tables()
+
     if analytics.empty or summaries.empty or validated.empty:
         raise HTTPException(
             status_code=404,
             detail="Base academic data not available. Run pipeline first.",
         )
 
-    a = analytics[analytics["student_id"] == sid]
-    s = summaries[summaries["student_id"] == sid]
-    i = insights[insights["student_id"] == sid]
-    c = consolidated[consolidated["student_id"] == sid]
+    a = student_rows("subject_analytics", sid)
+    s = student_rows("subject_summaries", sid)
+    i = student_rows("subject_insights", sid)
+    c = student_rows("student_consolidated_latest", sid)
 
     if a.empty or s.empty or c.empty:
         raise HTTPException(
@@ -144,17 +245,22 @@ def load_cached(student_id: str):
             detail=f"No cached data found for student_id={sid}",
         )
 
-    meta = get_student_metadata(validated, sid)
-    row = c.iloc[0]
+    meta = get_student_metadata(sid)
 
-    explain_map = {
-        r["subject"]: {
-            "explanation_summary":   normalize(r.get("explanation_summary")),
-            "key_evidence_points":   normalize(r.get("key_evidence_points")) or [],
-            "confidence_in_insight": normalize(r.get("confidence_in_insight")),
-            "recommended_focus_area": normalize(r.get("recommended_focus_area")),
+    explain_map = {} if i.empty else {
+        normalize(subject): {
+            "explanation_summary":   normalize(summary),
+            "key_evidence_points":   normalize(evidence) or [],
+            "confidence_in_insight": normalize(confidence),
+            "recommended_focus_area": normalize(focus),
         }
-        for r in df_to_records(i)
+        for subject, summary, evidence, confidence, focus in zip(
+            i["subject"],
+            _column(i, "explanation_summary"),
+            _column(i, "key_evidence_points"),
+            _column(i, "confidence_in_insight"),
+            _column(i, "recommended_focus_area"),
+        )
     }
 
     subject_insights = [
@@ -166,16 +272,14 @@ def load_cached(student_id: str):
         "student_id": sid,
         "student_name": meta["student_name"],
         "grade": meta["grade"],
-        "overall_summary": normalize(row.get("overall_summary")),
-        "recommended_next_steps": normalize(row.get("recommended_next_steps")),
+        "overall_summary": normalize(_first(c, "overall_summary")),
+        "recommended_next_steps": normalize(_first(c, "recommended_next_steps")),
         "numerical_performance": df_to_records(
-            a[
-                ["subject", "average_score", "latest_score", "trend", "risk_flag"]
-            ].sort_values("subject")
+            a[["subject", "average_score", "latest_score", "trend", "risk_flag"]]
         ),
         "subject_summaries": subject_insights,
         "mode": "cached",
-        "llm_provider_used": row.get("llm_provider", "ollama"),
+        "llm_provider_used": _first(c, "llm_provider", "ollama"),
     }
 
 # =====================================================
@@ -196,12 +300,11 @@ def get_live_summary(req: LiveStudentSummaryRequest):
     if not student_id:
         raise HTTPException(status_code=400, detail="student_id is required")
 
-    os.environ["LLM_PROVIDER"] = req.llm_provider.lower()
+    # Passed explicitly: os.environ is shared by every concurrent request
+    provider = req.llm_provider.lower()
 
-    analytics, summaries, _, _, validated = load_tables()
-
-    a = analytics[analytics["student_id"] == student_id]
-    s = summaries[summaries["student_id"] == student_id]
+    a = student_rows("subject_analytics", student_id)
+    s = student_rows("subject_summaries", student_id)
 
     if a.empty or s.empty:
         raise HTTPException(
@@ -209,14 +312,14 @@ def get_live_summary(req: LiveStudentSummaryRequest):
             detail=f"No base data found for student_id={student_id}",
         )
 
-    meta = get_student_metadata(validated, student_id)
+    meta = get_student_metadata(student_id)
 
     consolidated = generate_consolidated_summary(
         student_id=student_id,
         grade=meta["grade"],
         analytics=df_to_records(a),
         summaries=df_to_records(s),
-        llm_provider=req.llm_provider,
+        llm_provider=provider,
     )
 
     return {
@@ -234,8 +337,9 @@ def check_student_exists(student_id: str):
     try:
         client = get_gs_client()
         sheet = get_spreadsheet(client)
-        validated = normalize_student_id(read_table(sheet, "validated_results"))
-        analytics = normalize_student_id(read_table(sheet, "subject_analytics"))
+        tables = read_tables(sheet, ["validated_results", "subject_analytics"])
+        validated = normalize_student_id(tables["validated_results"])
+        analytics = normalize_student_id(tables["subject_analytics"])
         sid = student_id.strip()
         in_validated = (
             not validated.empty
@@ -274,6 +378,9 @@ def _start_pipeline_job(student_id: str = "", llm_provider: str = "ollama") -> s
         except Exception as exc:
             _pipeline_jobs[job_id]["status"] = "failed"
             _pipeline_jobs[job_id]["error"] = str(exc)
+        finally:
+            # A run (even a partial one) may have rewritten output tabs
+            invalidate_table_cache()
 
     threading.Thread(target=_worker, daemon=True).start()
     return job_id
@@ -303,6 +410,13 @@ def get_pipeline_status(job_id: str):
     return _pipeline_jobs[job_id]
 
 
+@app.post("/cache/invalidate")
+def invalidate_cache():
+    """Drop cached sheet tables so the next request re-reads Google Sheets."""
+    invalidate_table_cache()
+    return {"status": "ok"}
+
+
 @app.get("/debug/env")
 def debug_env():
     return {
@@ -4,12 +4,14 @@ import os
 import json
 import base64
 import time
+import threading
 import pandas as pd
 import numpy as np
 import gspread
 import streamlit as st
 from google.oauth2.service_account import Credentials
-from typing import List
+from gspread.utils import absolute_range_name, fill_gaps
+from typing import Dict, List
 
 
 SCOPES = [
@@ -102,11 +104,28 @@ def get_sheet_id() -> str:
 # AUTH
 # =====================================================
 
+# The authorized client refreshes its own token, so one
+# instance (and its opened spreadsheet) is shared by every
+# caller in the process and rebuilt every GS_CLIENT_TTL
+# seconds.
+
+GS_CLIENT_TTL = int(os.getenv("GS_CLIENT_TTL", str(50 * 60)))
+
+_gs_cache: dict = {"client": None, "spreadsheet": None, "created_at": 0.0}
+_gs_cache_lock = threading.Lock()
+
+
 def get_gs_client() -> gspread.Client:
-    return gspread.authorize(get_credentials())
+    with _gs_cache_lock:
+        age = time.monotonic() - _gs_cache["created_at"]
+        if _gs_cache["client"] is None or age > GS_CLIENT_TTL:
+            _gs_cache["client"] = gspread.authorize(get_credentials())
+            _gs_cache["spreadsheet"] = None
+            _gs_cache["created_at"] = time.monotonic()
+        return _gs_cache["client"]
 
 
-def get_spreadsheet(client: gspread.Client) -> gspread.Spreadsheet:
+def _open_spreadsheet(client: gspread.Client) -> gspread.Spreadsheet:
     try:
         sheet_id = get_sheet_id()
         return _with_backoff(client.open_by_key, sheet_id)
@@ -116,41 +135,218 @@ def get_spreadsheet(client: gspread.Client) -> gspread.Spreadsheet:
         return _with_backoff(client.open, GOOGLE_SHEETS_DB_NAME)
 
 
+def get_spreadsheet(client: gspread.Client) -> gspread.Spreadsheet:
+    with _gs_cache_lock:
+        if client is _gs_cache["client"] and _gs_cache["spreadsheet"] is not None:
+            return _gs_cache["spreadsheet"]
+
+    spreadsheet = _open_spreadsheet(client)
+
+    with _gs_cache_lock:
+        if client is _gs_cache["client"]:
+            _gs_cache["spreadsheet"] = spreadsheet
+    return spreadsheet
+
+
 # =====================================================
 # SANITIZER
 # =====================================================
 
 def _sanitize_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Blank out NaN / +-inf cells (not JSON-serializable) without touching the caller's frame."""
     if df is None or df.empty:
         return df
-    df = df.copy()
-    df.replace([np.nan, np.inf, -np.inf], "", inplace=True)
-    return df
+
+    # Only float and text columns can hold such cells; the rest pass through as-is
+    columns = []
+    for _, col in df.items():
+        if col.dtype.kind == "f" and isinstance(col.dtype, np.dtype):
+            bad = ~np.isfinite(col.to_numpy())
+            if bad.any():
+                col = col.astype(object).where(~bad, "")
+        elif col.dtype == object or pd.api.types.is_string_dtype(col.dtype):
+            bad = col.isna().to_numpy()
+            if bad.any():
+                col = col.where(~bad, "")
+        columns.append(col)
+
+    out = pd.concat(columns, axis=1)
+    out.columns = df.columns
+    return out
+
+
+# =====================================================
+# READ CACHE
+# Raw sheet values are kept on disk keyed by the
+# spreadsheet's Drive modifiedTime. An unchanged tab
+# costs one Drive metadata call instead of a full
+# Sheets values download (and read quota). Tabs that
+# do miss are fetched together in one batchGet.
+# Every write drops the tab's entry, read-modify-write
+# paths read with cached=False, and the tabs in
+# SHEETS_UNCACHED_TABLES (credentials) never touch disk.
+# Set SHEETS_CACHE_DIR="" to disable.
+# =====================================================
+
+SHEETS_CACHE_DIR = os.getenv("SHEETS_CACHE_DIR", ".cache/sheets")
+SHEETS_UNCACHED_TABLES = frozenset({"users"})
+
+
+def _cache_path(spreadsheet: gspread.Spreadsheet, table_name: str) -> str:
+    return os.path.join(SHEETS_CACHE_DIR, f"{spreadsheet.id}_{table_name}.json")
+
+
+def _invalidate_cache(spreadsheet: gspread.Spreadsheet, table_name: str):
+    if not SHEETS_CACHE_DIR:
+        return
+    try:
+        os.remove(_cache_path(spreadsheet, table_name))
+    except OSError:
+        pass
+
+
+def _fetch_values(spreadsheet: gspread.Spreadsheet, table_names: List[str]) -> Dict[str, list]:
+    # One values:batchGet request covers every tab
+    ranges = [absolute_range_name(name) for name in table_names]
+    response = _with_backoff(spreadsheet.values_batch_get, ranges)
+    # The API drops trailing empty cells; pad rows like get_all_values does
+    return {
+        name: fill_gaps(value_range["values"]) if value_range.get("values") else []
+        for name, value_range in zip(table_names, response["valueRanges"])
+    }
+
+
+def _read_values(spreadsheet: gspread.Spreadsheet, table_names: List[str]) -> Dict[str, list]:
+    cacheable = [name for name in table_names if name not in SHEETS_UNCACHED_TABLES]
+    if not SHEETS_CACHE_DIR or not cacheable:
+        return _fetch_values(spreadsheet, table_names)
+
+    try:
+        version = _with_backoff(spreadsheet.get_lastUpdateTime)
+    except Exception:
+        return _fetch_values(spreadsheet, table_names)
+
+    values = {}
+    for table_name in cacheable:
+        try:
+            with open(_cache_path(spreadsheet, table_name), encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("version") == version:
+                values[table_name] = cached["values"]
+        except (OSError, ValueError):
+            pass
+
+    missing = [name for name in table_names if name not in values]
+    if not missing:
+        return values
+
+    fetched = _fetch_values(spreadsheet, missing)
+    values.update(fetched)
+
+    for table_name, table_values in fetched.items():
+        if table_name in SHEETS_UNCACHED_TABLES:
+            continue
+        path = _cache_path(spreadsheet, table_name)
+        try:
+            os.makedirs(SHEETS_CACHE_DIR, exist_ok=True)
+            # Readers run on worker threads; keep temp names distinct
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": version, "values": table_values}, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    return values
 
 
 # =====================================================
 # READ
+# Every cell comes back from Sheets as a string, so
+# columns are built as Arrow-backed strings (pandas 3's
+# default "str" dtype) rather than Python objects.
+# Falls back to object dtype without pyarrow.
 # =====================================================
 
-def read_table(spreadsheet: gspread.Spreadsheet, table_name: str) -> pd.DataFrame:
-    worksheet = _with_backoff(spreadsheet.worksheet, table_name)
-    values = _with_backoff(worksheet.get_all_values)
+def _sheet_str_dtype():
+    try:
+        return pd.StringDtype("pyarrow", na_value=np.nan)
+    except TypeError:
+        # pandas < 2.3 spells the same dtype "pyarrow_numpy"
+        try:
+            return pd.StringDtype("pyarrow_numpy")
+        except (ValueError, ImportError):
+            return object
+    except ImportError:
+        return object
 
+
+SHEET_STR_DTYPE = _sheet_str_dtype()
+
+
+def _values_to_df(values: list) -> pd.DataFrame:
     if not values or len(values) < 2:
         return pd.DataFrame()
 
     headers = values[0]
     rows = values[1:]
-    return pd.DataFrame(rows, columns=headers)
+    return pd.DataFrame(rows, columns=headers, dtype=SHEET_STR_DTYPE)
+
+
+def read_tables(
+    spreadsheet: gspread.Spreadsheet, table_names: List[str], cached: bool = True
+) -> Dict[str, pd.DataFrame]:
+    """Read several tabs in one Sheets request.
+
+    Pass cached=False when the result will be modified and written back.
+    """
+    table_names = list(table_names)
+    if cached:
+        values = _read_values(spreadsheet, table_names)
+    else:
+        values = _fetch_values(spreadsheet, table_names)
+    return {name: _values_to_df(values[name]) for name in table_names}
+
+
+def read_table(spreadsheet: gspread.Spreadsheet, table_name: str, cached: bool = True) -> pd.DataFrame:
+    return read_tables(spreadsheet, [table_name], cached=cached)[table_name]
 
 
 # =====================================================
 # WRITE
+# Cells are sent RAW: stored exactly as given, with no
+# server-side parsing (or formula evaluation of LLM text).
+# Large tables go up in WRITE_CHUNK_ROWS-row requests.
 # =====================================================
 
+WRITE_CHUNK_ROWS = 5000
+
+
+def _df_payload(df: pd.DataFrame) -> list:
+    """Header row + data rows, converted to Python lists once."""
+    return [df.columns.tolist()] + df.to_numpy(dtype=object).tolist()
+
+
+def _write_values(ws: gspread.Worksheet, values: list):
+    for start in range(0, len(values), WRITE_CHUNK_ROWS):
+        _with_backoff(
+            ws.update,
+            values=values[start:start + WRITE_CHUNK_ROWS],
+            range_name=f"A{start + 1}",
+            raw=True,
+        )
+
+
 def write_table(spreadsheet, table_name: str, df: pd.DataFrame):
     df = _sanitize_df(df)
+    try:
+        _write_table(spreadsheet, table_name, df)
+    finally:
+        # Dropped after the write so a concurrent read cannot re-cache old values
+        _invalidate_cache(spreadsheet, table_name)
 
+
+def _write_table(spreadsheet, table_name: str, df: pd.DataFrame):
     try:
         ws = _with_backoff(spreadsheet.worksheet, table_name)
         _with_backoff(ws.clear)
@@ -162,7 +358,7 @@ def write_table(spreadsheet, table_name: str, df: pd.DataFrame):
             cols=str(len(df.columns) + 5),
         )
 
-    _with_backoff(ws.update, [df.columns.tolist()] + df.values.tolist())
+    _write_values(ws, _df_payload(df))
 
 
 def append_table(spreadsheet, table_name: str, df: pd.DataFrame):
@@ -170,7 +366,13 @@ def append_table(spreadsheet, table_name: str, df: pd.DataFrame):
         return
 
     df = _sanitize_df(df)
+    try:
+        _append_table(spreadsheet, table_name, df)
+    finally:
+        _invalidate_cache(spreadsheet, table_name)
+
 
+def _append_table(spreadsheet, table_name: str, df: pd.DataFrame):
     try:
         ws = _with_backoff(spreadsheet.worksheet, table_name)
         values = _with_backoff(ws.get_all_values)
@@ -183,16 +385,17 @@ def append_table(spreadsheet, table_name: str, df: pd.DataFrame):
         )
         values = []
 
-    if not values or values[0] != df.columns.tolist():
+    payload = _df_payload(df)
+    if not values or values[0] != payload[0]:
         _with_backoff(ws.clear)
-        _with_backoff(ws.update, [df.columns.tolist()] + df.values.tolist())
+        _write_values(ws, payload)
     else:
-        _with_backoff(ws.append_rows, df.values.tolist(), value_input_option="USER_ENTERED")
+        _with_backoff(ws.append_rows, payload[1:], value_input_option="RAW")
 
 
 def update_user_student_id(spreadsheet, email: str, student_id: str):
     """Set student_id for a user row identified by email, adding the column if missing."""
-    df = read_table(spreadsheet, "users")
+    df = read_table(spreadsheet, "users", cached=False)
     if df.empty or "email" not in df.columns:
         return
     if "student_id" not in df.columns:
@@ -219,7 +422,7 @@ def _filter_by_student(table_name: str, student_id: str) -> pd.DataFrame:
     df = read_table(sp, table_name)
     if df.empty or "student_id" not in df.columns:
         return pd.DataFrame()
-    df["student_id"] = df["student_id"].astype(str).str.strip()
+    df["student_id"] = df["student_id"].astype(SHEET_STR_DTYPE).str.strip()
     return df[df["student_id"] == student_id.strip()]
 
 
@@ -242,9 +445,7 @@ def get_subject_analytics(student_id: str) -> list:
 
 def list_worksheet_titles() -> list:
     """Return the .title of every worksheet in the spreadsheet. Used for debugging tab names."""
-    creds = get_credentials()
-    client = gspread.authorize(creds)
-    sheet = client.open_by_key(get_sheet_id())
+    sheet = get_spreadsheet(get_gs_client())
     return [ws.title for ws in sheet.worksheets()]
 
 
@@ -257,11 +458,9 @@ def get_student_report_direct(student_id: str) -> dict:
     All other errors (auth failure, bad sheet ID, API 4xx/5xx) propagate so
     the caller can surface the real exception type instead of hiding it.
     """
-    creds = get_credentials()
-    client = gspread.authorize(creds)
     # Deliberately NOT in try/except — a 404 here means the spreadsheet itself
     # is inaccessible (wrong ID or missing share permission). Let it propagate.
-    sheet = client.open_by_key(get_sheet_id())
+    sheet = get_spreadsheet(get_gs_client())
 
     tabs = {
         "consolidated": "student_consolidated_latest",
@@ -344,7 +543,7 @@ def upsert_table(spreadsheet, table_name: str, df: pd.DataFrame, key_columns: Li
     df = _sanitize_df(df)
 
     try:
-        existing = read_table(spreadsheet, table_name)
+        existing = read_table(spreadsheet, table_name, cached=False)
     except Exception:
         existing = pd.DataFrame()
 
@@ -352,8 +551,9 @@ def upsert_table(spreadsheet, table_name: str, df: pd.DataFrame, key_columns: Li
         write_table(spreadsheet, table_name, df)
         return
 
-    mask = ~existing[key_columns].apply(tuple, axis=1).isin(
-        df[key_columns].apply(tuple, axis=1)
+    # Hash anti-join on the key columns
+    mask = ~pd.MultiIndex.from_frame(existing[key_columns]).isin(
+        pd.MultiIndex.from_frame(df[key_columns])
     )
     final_df = pd.concat([existing[mask], df], ignore_index=True)
     write_table(spreadsheet, table_name, final_df)
@@ -3,13 +3,16 @@
 import os
 import streamlit as st
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import hashlib
+import html
 import uuid
 import re
 import time
 from datetime import datetime, timezone
 
+import orjson
 import pandas as pd
 import plotly.graph_objects as go
 from dotenv import load_dotenv
@@ -49,8 +52,35 @@ API_BASE        = "https://ai-student-intelligence.onrender.com" if IS_CLOUD els
 CACHED_ENDPOINT = f"{API_BASE}/student-summary"
 LIVE_ENDPOINT   = f"{API_BASE}/student-summary/live"
 EMAIL_RE        = re.compile(r'^[a-zA-Z0-9._%+\-]+@[a-zA-Z0-9.\-]+\.[a-zA-Z]{2,}$')
+STUDENT_ID_RE   = re.compile(r'[A-Za-z0-9_-]{1,32}')
 ROLES           = ["Teacher", "Parent", "Student", "Admin"]
 
+
+@st.cache_resource(show_spinner=False)
+def _http_session() -> requests.Session:
+    """
+    One keep-alive connection pool for every backend call. Streamlit
+    re-executes this script per interaction, so the session lives in
+    cache_resource; later reports skip the TCP/TLS handshake to Render.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        # Only idempotent methods are retried on 5xx; a pipeline POST is never resent.
+        # read=0: a read timeout is never retried, so each call keeps the timeout it asks for
+        max_retries=Retry(
+            total=3, read=0, backoff_factor=0.3,
+            status_forcelist=[502, 503, 504], raise_on_status=False,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+SESSION = _http_session()
+
 DEMO_USERS = {
     "admin@stemglobe.io": "stemglobe2025",
     "demo@stemglobe.io":  "demo1234",
@@ -180,9 +210,6 @@ def _build_nav_icon_css() -> str:
 """
     return css
 
-
-_NAV_ICON_CSS = _build_nav_icon_css()
-
 # ============================================================
 # PAGE CONFIG
 # ============================================================
@@ -196,9 +223,14 @@ st.set_page_config(
 
 # ============================================================
 # GLOBAL CSS
+# Built once per process: Streamlit re-executes this script on
+# every interaction, and the stylesheet never changes.
 # ============================================================
 
-GLOBAL_CSS = f"""
+@st.cache_data(show_spinner=False)
+def _global_css() -> str:
+    nav_icon_css = _build_nav_icon_css()
+    return f"""
 <style>
 @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap');
 
@@ -280,7 +312,7 @@ html, body,
 }}
 
 /* nav SVG icons */
-{_NAV_ICON_CSS}
+{nav_icon_css}
 
 /* logout button */
 .logout-wrap .stButton > button {{
@@ -621,7 +653,9 @@ div[data-testid="stRadio"] label:hover {{ border-color:rgba(41,121,255,.4) !impo
 }}
 </style>
 """
-st.markdown(GLOBAL_CSS, unsafe_allow_html=True)
+
+
+st.markdown(_global_css(), unsafe_allow_html=True)
 
 # ============================================================
 # SESSION STATE
@@ -654,6 +688,10 @@ def _hash(pw: str) -> str:
 def _valid_email(email: str) -> bool:
     return bool(EMAIL_RE.match(email.strip()))
 
+def _valid_student_id(student_id: str) -> bool:
+    """Same rule the dashboard applies before a lookup, so every stored ID stays searchable."""
+    return bool(STUDENT_ID_RE.fullmatch(student_id.strip()))
+
 def _password_strength(pw: str):
     if not pw:
         return 0, "", "#1a1a1a"
@@ -965,6 +1003,8 @@ def show_register():
             elif not _valid_email(email):      err = "Please enter a valid email address."
             elif len(password) < 8:            err = "Password must be at least 8 characters."
             elif password != confirm:          err = "Passwords do not match."
+            elif reg_student_id.strip() and not _valid_student_id(reg_student_id):
+                err = "Student ID may only contain letters, digits, - and _ (max 32)."
             if err:
                 st.session_state.register_error = err
                 st.rerun()
@@ -1084,23 +1124,27 @@ with st.sidebar:
 # the app works on Streamlit Cloud without a FastAPI server.
 # ============================================================
 
+# orjson.loads can only succeed on text starting with one of these
+_JSON_START = frozenset('{["-0123456789tfn')
+
+
 def _normalize_val(value):
     """Normalize a raw Google Sheets cell value for UI display."""
-    if value is None:
-        return ""
-    try:
-        if isinstance(value, float) and pd.isna(value):
-            return ""
-    except Exception:
-        pass
-    if isinstance(value, (list, dict)):
-        return value
-    if isinstance(value, str):
+    if type(value) is str:
         v = value.strip()
+        if not v or v[0] not in _JSON_START:
+            return v
         try:
-            return json.loads(v)
-        except Exception:
+            return orjson.loads(v)
+        except orjson.JSONDecodeError:
             return v
+    if value is None:
+        return ""
+    # NaN is the only float unequal to itself
+    if isinstance(value, float) and value != value:
+        return ""
+    if isinstance(value, str):
+        return _normalize_val(str(value))
     return value
 
 
@@ -1108,13 +1152,16 @@ def _df_to_records(df: pd.DataFrame) -> list:
     """Convert a DataFrame to a normalized list-of-dicts for the UI."""
     if df is None or df.empty:
         return []
-    records = json.loads(df.to_json(orient="records"))
+    records = df.to_dict(orient="records")
     return [{k: _normalize_val(v) for k, v in row.items()} for row in records]
 
 
+@st.cache_data(ttl=300, show_spinner=False)
 def _load_cached_direct(student_id: str) -> dict:
     """
     Read pre-computed student data from Google Sheets directly.
+    Cached for 5 min per student. Misses raise, and st.cache_data never
+    stores a raised lookup, so a student processed later is seen at once.
 
     Raises:
         LookupError("NOT_FOUND:True")  – student in raw data but not yet processed
@@ -1214,13 +1261,19 @@ def score_color(score):
         return "amber"
     return "green" if s >= 70 else "amber" if s >= 50 else "red"
 
+# Exact values written by analytics.metrics; anything else falls back to a substring scan
+_TREND_LABELS = {"improving": "↑ Improving", "declining": "↓ Declining", "stable": "— Stable"}
+_TREND_COLORS = {"improving": "green", "declining": "red", "stable": "amber"}
+
 def trend_label(trend):
+    if trend in _TREND_LABELS: return _TREND_LABELS[trend]
     t = str(trend).lower()
     if "up" in t or "improv" in t:   return "↑ Improving"
     if "down" in t or "declin" in t: return "↓ Declining"
     return "— Stable"
 
 def trend_color(trend):
+    if trend in _TREND_COLORS: return _TREND_COLORS[trend]
     t = str(trend).lower()
     if "up" in t or "improv" in t:   return "green"
     if "down" in t or "declin" in t: return "red"
@@ -1231,14 +1284,21 @@ def normalize_next_steps(value):
     if isinstance(value, dict): return [f"{k}: {v}" for k, v in value.items()]
     if isinstance(value, list): return value
     if isinstance(value, str):
+        # Only a JSON object/array can yield steps; skip the parse attempt otherwise
+        if value.lstrip()[:1] not in ("[", "{"):
+            return [value]
         try:
-            parsed = json.loads(value)
+            parsed = orjson.loads(value)
             if isinstance(parsed, dict): return [f"{k}: {v}" for k, v in parsed.items()]
             if isinstance(parsed, list): return parsed
-        except Exception:
+        except orjson.JSONDecodeError:
             return [value]
     return []
 
+def _esc(value) -> str:
+    """HTML-escape a report value before it goes into raw markup."""
+    return html.escape(str(value))
+
 def _section_label(text: str, color: str = "#2979ff") -> str:
     return (
         f'<div style="font-size:.67rem;font-weight:700;letter-spacing:.13em;'
@@ -1253,6 +1313,70 @@ def _cached_sheet(_table: str) -> list:
     _df = read_table(_sp, _table)
     return [] if _df.empty else _df.to_dict("records")
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_report_direct(student_id: str) -> dict:
+    """
+    get_student_report_direct, cached for 5 min per student.
+
+    Raises:
+        LookupError("NO_DATA")   – no pipeline data exists yet
+        LookupError("NOT_FOUND") – this student has not been processed
+    Raising keeps incomplete reports out of the cache.
+    """
+    report = get_student_report_direct(student_id)
+    parts  = (report["consolidated"], report["analytics"], report["summaries"])
+    if not any(parts):
+        raise LookupError("NO_DATA")
+    if not all(parts):
+        raise LookupError("NOT_FOUND")
+    return report
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_live_report(student_id: str, llm_provider: str) -> dict:
+    """POST to the live endpoint, cached for 5 min per (student, provider).
+
+    Non-200 responses raise HTTPError, so failures are never cached.
+    """
+    response = SESSION.post(
+        LIVE_ENDPOINT,
+        data=orjson.dumps({"student_id": student_id, "llm_provider": llm_provider}),
+        headers={"Content-Type": "application/json"},
+        timeout=180,
+    )
+    response.raise_for_status()
+    # Parse the body bytes directly (no charset sniff / str decode)
+    return orjson.loads(response.content)
+
+def _clear_report_caches():
+    """Drop every cached report; call only once a pipeline job reports done."""
+    _load_cached_direct.clear()
+    _cached_report_direct.clear()
+    _fetch_live_report.clear()
+
+def _wait_for_pipeline(job_id: str, target_sid: str = "", attempts: int = 60) -> tuple:
+    """
+    Poll a pipeline job every 5 s (up to 5 min by default).
+    Returns (status, error) with status "done", "failed" or "running".
+    Caches are cleared on "done"; a job still running is handed to the
+    dashboard poll, which clears them when it finishes.
+    """
+    for _ in range(attempts):
+        time.sleep(5)
+        try:
+            _sr = SESSION.get(f"{API_BASE}/pipeline/status/{job_id}", timeout=10)
+            _state = _sr.json()
+        except Exception:
+            continue
+        _status = _state.get("status", "running")
+        if _status == "done":
+            _clear_report_caches()
+            return "done", ""
+        if _status == "failed":
+            return "failed", _state.get("error", "")
+    st.session_state["_pipeline_job_id"] = job_id
+    st.session_state["_pipeline_target_sid"] = target_sid
+    return "running", ""
+
 # ============================================================
 # DASHBOARD PAGE
 # ============================================================
@@ -1263,16 +1387,12 @@ def show_dashboard():
     is_student = (role == "Student")
 
     # ── Pipeline job polling ─────────────────────────────────
+    # Cloud jobs run on Render; API_BASE points there, so the same poll applies
     _job_id = st.session_state.get("_pipeline_job_id")
-    if _job_id and IS_CLOUD:
-        # Pipeline jobs run on Render; clear any stale state on cloud
-        st.session_state.pop("_pipeline_job_id", None)
-        st.session_state.pop("_pipeline_target_sid", None)
-        _job_id = None
     if _job_id:
         _target_sid = st.session_state.get("_pipeline_target_sid", "")
         try:
-            _poll = requests.get(f"{API_BASE}/pipeline/status/{_job_id}", timeout=10)
+            _poll = SESSION.get(f"{API_BASE}/pipeline/status/{_job_id}", timeout=10)
             _jstate = _poll.json() if _poll.ok else {"status": "unknown"}
         except Exception:
             _jstate = {"status": "unknown"}
@@ -1297,6 +1417,8 @@ def show_dashboard():
             time.sleep(4)
             st.rerun()
         elif _jstatus == "done":
+            # Fresh pipeline output: drop cached reports so the rerun reads it
+            _clear_report_caches()
             st.session_state.pop("_pipeline_job_id", None)
             _done_sid = st.session_state.pop("_pipeline_target_sid", "")
             if _done_sid and not is_student:
@@ -1371,7 +1493,7 @@ def show_dashboard():
 
                 if _link_clicked:
                     _typed = _new_sid.strip()
-                    if _typed:
+                    if _valid_student_id(_typed):
                         try:
                             _lc = get_gs_client()
                             _ls = get_spreadsheet(_lc)
@@ -1518,12 +1640,15 @@ def show_dashboard():
                 with _pc2:
                     if st.button("Run Pipeline", key="run_pipeline_cloud_btn", use_container_width=True):
                         try:
-                            _fpr = requests.post(
+                            _fpr = SESSION.post(
                                 "https://ai-student-intelligence.onrender.com/run-pipeline",
                                 timeout=30,
                             )
                             if _fpr.ok:
-                                st.success("Pipeline triggered. Reports will update shortly.")
+                                # Caches are cleared by the job poll once the run is done
+                                st.session_state["_pipeline_job_id"] = _fpr.json().get("job_id")
+                                st.session_state.pop("_pipeline_target_sid", None)
+                                st.rerun()
                             else:
                                 st.error(f"Pipeline returned HTTP {_fpr.status_code}.")
                         except Exception as _fpe:
@@ -1540,7 +1665,7 @@ def show_dashboard():
                 with _pc2:
                     if st.button("Run Full Pipeline", key="run_full_pipeline_btn", use_container_width=True):
                         try:
-                            _fpr = requests.post(
+                            _fpr = SESSION.post(
                                 f"{API_BASE}/pipeline/run",
                                 json={"student_id": "", "llm_provider": llm_provider},
                                 timeout=20,
@@ -1566,31 +1691,39 @@ def show_dashboard():
                 unsafe_allow_html=True,
             )
             st.stop()
+        # A malformed ID can never match; reject it before any Sheets/HTTP call
+        if not _valid_student_id(student_id):
+            st.markdown(
+                f'<div class="auth-error">{icon("alert","#ff3d57",14)}&nbsp;'
+                f'Invalid Student ID format.</div>',
+                unsafe_allow_html=True,
+            )
+            st.stop()
 
         # Top progress bar
         st.markdown('<div class="sg-topbar-progress"></div>', unsafe_allow_html=True)
 
         if IS_CLOUD:
             # ── Cloud: read directly from Google Sheets, ZERO HTTP calls ─
-            # This branch MUST NOT reach any requests.get/post. If an error
+            # This branch MUST NOT reach any SESSION.get/post. If an error
             # escapes here it is a gspread/auth error, not a Render API 404.
             with st.spinner("Loading student data…"):
                 try:
                     _sid_clean = student_id.strip()
-                    _raw = get_student_report_direct(_sid_clean)
-
-                    # Nothing in any sheet → pipeline has never run
-                    if not _raw["consolidated"] and not _raw["analytics"] and not _raw["summaries"]:
-                        st.markdown(
-                            f'<div class="auth-error">{icon("alert","#ff3d57",14)}&nbsp;'
-                            f'No pipeline data found in Google Sheets. '
-                            f'Run the analytics pipeline from your Render dashboard first.</div>',
-                            unsafe_allow_html=True,
-                        )
-                        st.stop()
+                    try:
+                        _raw = _cached_report_direct(_sid_clean)
+                    except LookupError as _le:
+                        # Nothing in any sheet → pipeline has never run
+                        if str(_le) == "NO_DATA":
+                            st.markdown(
+                                f'<div class="auth-error">{icon("alert","#ff3d57",14)}&nbsp;'
+                                f'No pipeline data found in Google Sheets. '
+                                f'Run the analytics pipeline from your Render dashboard first.</div>',
+                                unsafe_allow_html=True,
+                            )
+                            st.stop()
 
-                    # This student specifically has no processed data
-                    if not _raw["consolidated"] or not _raw["analytics"] or not _raw["summaries"]:
+                        # This student specifically has no processed data
                         st.markdown(
                             f'<div class="auth-error">{icon("alert","#ff3d57",14)}&nbsp;'
                             f'No report found for <strong>{_sid_clean}</strong>. '
@@ -1668,7 +1801,7 @@ def show_dashboard():
                         """, unsafe_allow_html=True)
                         if st.button(f"Process {_sid_clean} Now", key="process_now_btn"):
                             try:
-                                _pr = requests.post(
+                                _pr = SESSION.post(
                                     f"{API_BASE}/pipeline/run",
                                     json={"student_id": _sid_clean, "llm_provider": llm_provider},
                                     timeout=20,
@@ -1701,19 +1834,21 @@ def show_dashboard():
                     st.stop()
         else:
             # ── Live mode via Render backend (local only, no fast_mode) ───
-            payload = {"student_id": student_id.strip(), "llm_provider": llm_provider}
             with st.spinner("Generating live AI summary…"):
                 try:
-                    response = requests.post(LIVE_ENDPOINT, json=payload, timeout=180)
+                    data = _fetch_live_report(student_id.strip(), llm_provider)
+                    _status = 200
                 except requests.exceptions.ConnectionError:
                     st.error("Cannot reach the backend. Is pipeline_server.py running?")
                     st.stop()
+                except requests.exceptions.HTTPError as _he:
+                    _status = _he.response.status_code
 
-            if response.status_code == 404:
+            if _status == 404:
                 _sid_clean = student_id.strip()
                 _in_raw = False
                 try:
-                    _ex = requests.get(f"{API_BASE}/student/exists/{_sid_clean}", timeout=15)
+                    _ex = SESSION.get(f"{API_BASE}/student/exists/{_sid_clean}", timeout=15)
                     if _ex.ok:
                         _in_raw = _ex.json().get("in_validated_results", False)
                 except Exception:
@@ -1735,7 +1870,7 @@ def show_dashboard():
                     """, unsafe_allow_html=True)
                     if st.button(f"Process {_sid_clean} Now", key="process_now_btn"):
                         try:
-                            _pr = requests.post(
+                            _pr = SESSION.post(
                                 f"{API_BASE}/pipeline/run",
                                 json={"student_id": _sid_clean, "llm_provider": llm_provider},
                                 timeout=20,
@@ -1756,12 +1891,10 @@ def show_dashboard():
                         unsafe_allow_html=True,
                     )
                 st.stop()
-            if response.status_code != 200:
-                st.error(f"Backend returned {response.status_code}. Check server logs.")
+            if _status != 200:
+                st.error(f"Backend returned {_status}. Check server logs.")
                 st.stop()
 
-            data = response.json()
-
         name          = data.get("student_name", "").upper() or student_id.upper()
         grade         = data.get("grade", "—")
         mode_label    = data.get("mode", "cached" if fast_mode else "live")
@@ -1807,19 +1940,21 @@ def show_dashboard():
         kpi_books   = icon("books",     bc,   26, 1.8)
 
         # ── 1. Student header ─────────────────────────────────────
-        st.markdown(f"""
+        # Report cards are plain HTML: st.html skips the markdown parser.
+        # Header and overview are adjacent, so they go out as one element
+        header_html = f"""
         <div style="background:linear-gradient(135deg,#050913 0%,#090f1d 60%,#050913 100%);
                     border:1px solid #131d33;border-radius:24px;padding:2rem 2.2rem 1.6rem;
                     margin-bottom:1.5rem;box-shadow:0 8px 40px rgba(0,0,0,.65);">
           <div style="display:flex;align-items:center;gap:1rem;margin-bottom:1.4rem;flex-wrap:wrap;">
-            <div style="font-size:2.3rem;font-weight:800;color:#f0f0f0;letter-spacing:-.03em;line-height:1;">{name}</div>
+            <div style="font-size:2.3rem;font-weight:800;color:#f0f0f0;letter-spacing:-.03em;line-height:1;">{_esc(name)}</div>
             <span style="display:inline-flex;align-items:center;background:rgba(41,121,255,.14);
                          border:1px solid rgba(41,121,255,.3);color:#2979ff;font-size:.76rem;
                          font-weight:700;letter-spacing:.07em;text-transform:uppercase;
-                         padding:.28rem .8rem;border-radius:99px;">Grade {grade}</span>
+                         padding:.28rem .8rem;border-radius:99px;">Grade {_esc(grade)}</span>
             <span style="margin-left:auto;display:flex;gap:.5rem;align-items:center;flex-wrap:wrap;">
-              <span class="sg-badge {badge_cls}">{mode_label.capitalize()} Mode</span>
-              <span style="font-size:.73rem;color:#666;">Engine:&nbsp;<strong style="color:#2979ff">{provider_used}</strong></span>
+              <span class="sg-badge {badge_cls}">{_esc(mode_label.capitalize())} Mode</span>
+              <span style="font-size:.73rem;color:#666;">Engine:&nbsp;<strong style="color:#2979ff">{_esc(provider_used)}</strong></span>
             </span>
           </div>
           <div style="display:grid;grid-template-columns:repeat(4,1fr);gap:.9rem;">
@@ -1830,7 +1965,7 @@ def show_dashboard():
             </div>
             <div style="background:{rg};border:1px solid {rb};border-radius:16px;padding:1.25rem 1rem;text-align:center;box-shadow:0 2px 12px rgba(0,0,0,.4);">
               <div style="margin-bottom:.35rem;">{kpi_alert}</div>
-              <div style="font-size:1.55rem;font-weight:800;color:{rc};line-height:1;letter-spacing:-.01em;">{overall_risk}</div>
+              <div style="font-size:1.55rem;font-weight:800;color:{rc};line-height:1;letter-spacing:-.01em;">{_esc(overall_risk)}</div>
               <div style="font-size:.67rem;font-weight:700;color:#666;letter-spacing:.08em;text-transform:uppercase;margin-top:.4rem;">Risk Level</div>
             </div>
             <div style="background:{tg};border:1px solid {tb};border-radius:16px;padding:1.25rem 1rem;text-align:center;box-shadow:0 2px 12px rgba(0,0,0,.4);">
@@ -1846,21 +1981,21 @@ def show_dashboard():
             </div>
           </div>
         </div>
-        """, unsafe_allow_html=True)
+        """
 
         # ── 2. Academic overview ──────────────────────────────────
         overview = data.get("overall_summary", "")
-        st.markdown(
-            f'<div class="sg-card">'
+        st.html(
+            header_html
+            + f'<div class="sg-card">'
             f'<div style="font-size:.67rem;font-weight:700;letter-spacing:.13em;text-transform:uppercase;'
             f'color:#2979ff;margin-bottom:.75rem;">Academic Overview</div>'
             + (
-                f'<p style="font-size:.92rem;color:#c0c8d8;line-height:1.78;margin:0">{overview}</p>'
+                f'<p style="font-size:.92rem;color:#c0c8d8;line-height:1.78;margin:0">{_esc(overview)}</p>'
                 if overview else
                 f'<p style="font-size:.84rem;color:#555;margin:0;font-style:italic;">No data available.</p>'
             )
-            + '</div>',
-            unsafe_allow_html=True,
+            + '</div>'
         )
 
         # ── 3. Radar chart ────────────────────────────────────────
@@ -1918,8 +2053,8 @@ def show_dashboard():
         # ── 4. Subject performance cards ──────────────────────────
         if metrics:
             st.markdown(_section_label("Subject Performance"), unsafe_allow_html=True)
-            cols = st.columns(len(metrics))
-            for col, row in zip(cols, metrics):
+            cards = []
+            for row in metrics:
                 subj  = row.get("subject", "Subject")
                 score = row.get("latest_score", 0)
                 avg   = row.get("average_score", 0)
@@ -1941,27 +2076,32 @@ def show_dashboard():
                 bdr = {"green": "rgba(0,230,118,.2)", "amber": "rgba(255,171,64,.2)",
                        "red":   "rgba(255,61,87,.2)"}.get(c, "#1a1a1a")
 
-                with col:
-                    st.markdown(f"""
+                cards.append(f"""
                     <div class="subj-card" style="background:{gbg};border:1px solid {bdr};
                                 border-radius:18px;padding:1.5rem 1.3rem 1.2rem;
                                 box-shadow:0 4px 20px rgba(0,0,0,.5);">
                       <div style="display:flex;align-items:center;gap:.55rem;margin-bottom:.9rem;">
                         {subj_icon}
-                        <span style="font-size:.84rem;font-weight:700;color:#c8d0e0;">{subj}</span>
+                        <span style="font-size:.84rem;font-weight:700;color:#c8d0e0;">{_esc(subj)}</span>
                       </div>
-                      <div style="font-size:3rem;font-weight:800;color:{pc};line-height:1;letter-spacing:-.04em;margin-bottom:.1rem;">{score}</div>
+                      <div style="font-size:3rem;font-weight:800;color:{pc};line-height:1;letter-spacing:-.04em;margin-bottom:.1rem;">{_esc(score)}</div>
                       <div style="font-size:.64rem;color:#555;letter-spacing:.07em;text-transform:uppercase;margin-bottom:.7rem;">out of 100</div>
                       <div style="background:rgba(255,255,255,.05);border-radius:99px;height:6px;overflow:hidden;margin-bottom:.85rem;">
                         <div style="height:6px;width:{pct}%;background:{pc};border-radius:99px;box-shadow:0 0 8px {pc}55;"></div>
                       </div>
                       <div style="display:flex;align-items:center;justify-content:space-between;gap:.3rem;flex-wrap:wrap;">
-                        <span style="font-size:.73rem;color:#666;">Avg&nbsp;<strong style="color:#a0a8b0">{avg}</strong></span>
+                        <span style="font-size:.73rem;color:#666;">Avg&nbsp;<strong style="color:#a0a8b0">{_esc(avg)}</strong></span>
                         <span style="font-size:.73rem;font-weight:700;color:{tch};">{tl}</span>
-                        <span class="sg-badge {c}" style="font-size:.61rem;">{risk}</span>
+                        <span class="sg-badge {c}" style="font-size:.61rem;">{_esc(risk)}</span>
                       </div>
                     </div>
-                    """, unsafe_allow_html=True)
+                    """)
+
+            # One grid, one element for every card
+            st.html(
+                f'<div style="display:grid;grid-template-columns:repeat({len(cards)},minmax(0,1fr));'
+                f'gap:1rem;">{"".join(cards)}</div>'
+            )
 
         st.markdown("<div style='height:1.1rem'></div>", unsafe_allow_html=True)
 
@@ -1969,6 +2109,23 @@ def show_dashboard():
         subject_summaries = data.get("subject_summaries", [])
         if subject_summaries:
             st.markdown(_section_label("Subject Insights &amp; Evidence"), unsafe_allow_html=True)
+
+            # Comparison-chart series are the same for every subject; only the
+            # highlighted bar changes, so scores and colours are computed once
+            _rgb = {
+                "green": (0, 230, 118),
+                "amber": (255, 171, 64),
+                "red":   (255, 61, 87),
+            }
+            chart_subjs, chart_scores, chart_avgs, chart_rgbs = [], [], [], []
+            for m in metrics:
+                chart_subjs.append(m.get("subject", ""))
+                try:    chart_scores.append(float(m.get("latest_score", 0)))
+                except: chart_scores.append(0.0)
+                try:    chart_avgs.append(float(m.get("average_score", 0)))
+                except: chart_avgs.append(0.0)
+                chart_rgbs.append(_rgb.get(score_color(m.get("latest_score", 0)), (41, 121, 255)))
+
             for subj in subject_summaries:
                 subj_name = subj.get("subject", "Subject")
                 subj_icon = SUBJ_ICONS.get(subj_name, _DEF_SUBJ_ICON)
@@ -1987,7 +2144,16 @@ def show_dashboard():
 
                 with st.expander(subj_name, expanded=False):
 
-                    st.markdown(f"""
+                    # The chart is the only non-HTML element, so the cards
+                    # before and after it go out as one st.html call each
+                    chart_label = (
+                        f'<div style="font-size:.62rem;font-weight:700;letter-spacing:.12em;'
+                        f'text-transform:uppercase;color:#00c8e0;margin-bottom:.25rem;'
+                        f'display:flex;align-items:center;gap:.4rem;">'
+                        f'{icon("bar-chart","#00c8e0",12,2)}&nbsp;Score Comparison</div>'
+                        if metrics else ""
+                    )
+                    st.html(f"""
 <div style="background:#06101a;border:1px solid #1a2540;border-left:3px solid #2979ff;
             border-radius:12px;padding:1.1rem 1.3rem;margin-bottom:1rem;">
   <div style="font-size:.62rem;font-weight:700;letter-spacing:.12em;text-transform:uppercase;
@@ -1995,32 +2161,14 @@ def show_dashboard():
     {icon("bar-chart","#2979ff",12,2)}&nbsp;Performance Summary
   </div>
   <p style="font-size:.89rem;color:#CBD5E1;line-height:1.74;margin:0">
-    {subj.get("performance_summary", "—")}</p>
-</div>""", unsafe_allow_html=True)
+    {_esc(subj.get("performance_summary", "—"))}</p>
+</div>{chart_label}""")
 
                     # Plotly bar chart — subject comparison
                     if metrics:
-                        chart_subjs, chart_scores, chart_avgs = [], [], []
-                        for m in metrics:
-                            chart_subjs.append(m.get("subject", ""))
-                            try:    chart_scores.append(float(m.get("latest_score", 0)))
-                            except: chart_scores.append(0.0)
-                            try:    chart_avgs.append(float(m.get("average_score", 0)))
-                            except: chart_avgs.append(0.0)
-
-                        _rgb = {
-                            "#00e676": (0, 230, 118),
-                            "#ffab40": (255, 171, 64),
-                            "#ff3d57": (255, 61, 87),
-                            "#2979ff": (41, 121, 255),
-                        }
                         score_clrs, avg_clrs = [], []
-                        for s_name in chart_subjs:
-                            sm   = next((m for m in metrics if m.get("subject") == s_name), {})
-                            c_s  = score_color(sm.get("latest_score", 0))
-                            base = {"green": "#00e676", "amber": "#ffab40", "red": "#ff3d57"}.get(c_s, "#2979ff")
+                        for s_name, (r, g, b) in zip(chart_subjs, chart_rgbs):
                             is_cur = s_name == subj_name
-                            r, g, b = _rgb.get(base, (41, 121, 255))
                             score_clrs.append(f"rgba({r},{g},{b},{'0.8' if is_cur else '0.2'})")
                             avg_clrs.append("rgba(0,200,224,0.7)" if is_cur else "rgba(0,200,224,0.2)")
 
@@ -2057,16 +2205,9 @@ def show_dashboard():
                                 tickfont=dict(size=9, color="#555", family="Inter"),
                             ),
                         )
-                        st.markdown(
-                            f'<div style="font-size:.62rem;font-weight:700;letter-spacing:.12em;'
-                            f'text-transform:uppercase;color:#00c8e0;margin-bottom:.25rem;'
-                            f'display:flex;align-items:center;gap:.4rem;">'
-                            f'{icon("bar-chart","#00c8e0",12,2)}&nbsp;Score Comparison</div>',
-                            unsafe_allow_html=True,
-                        )
                         st.plotly_chart(fig_bar, use_container_width=True, config={"displayModeBar": False})
 
-                    st.markdown(f"""
+                    after_chart = f"""
 <div style="background:#041414;border:1px solid #0d2a2a;border-left:3px solid #00c8e0;
             border-radius:12px;padding:1.1rem 1.3rem;margin-bottom:1rem;">
   <div style="font-size:.62rem;font-weight:700;letter-spacing:.12em;text-transform:uppercase;
@@ -2074,10 +2215,10 @@ def show_dashboard():
     {icon("target","#00c8e0",12,2)}&nbsp;Improvement Plan
   </div>
   <p style="font-size:.89rem;color:#CBD5E1;line-height:1.74;margin:0">
-    {subj.get("improvement_plan", "—")}</p>
-</div>""", unsafe_allow_html=True)
+    {_esc(subj.get("improvement_plan", "—"))}</p>
+</div>"""
 
-                    st.markdown(f"""
+                    after_chart += f"""
 <div style="background:#0d0900;border:1px solid rgba(255,171,64,.18);border-left:3px solid #ffab40;
             border-radius:12px;padding:1.1rem 1.3rem;margin-bottom:1rem;">
   <div style="font-size:.62rem;font-weight:700;letter-spacing:.12em;text-transform:uppercase;
@@ -2085,13 +2226,13 @@ def show_dashboard():
     {icon("sparkles","#ffab40",12,2)}&nbsp;Motivation Note
   </div>
   <p style="font-size:.89rem;color:#CBD5E1;line-height:1.74;margin:0;font-style:italic;">
-    {subj.get("motivation_note", "—")}</p>
-</div>""", unsafe_allow_html=True)
+    {_esc(subj.get("motivation_note", "—"))}</p>
+</div>"""
 
                     ev_bullets = "".join(f"""
 <div style="display:flex;gap:.65rem;align-items:flex-start;margin-bottom:.52rem;">
   <span style="margin-top:.22rem;flex-shrink:0;">{icon("dot","#2979ff",10)}</span>
-  <span style="font-size:.85rem;color:#CBD5E1;line-height:1.62;">{e}</span>
+  <span style="font-size:.85rem;color:#CBD5E1;line-height:1.62;">{_esc(e)}</span>
 </div>""" for e in evidence)
 
                     if focus_areas:
@@ -2099,7 +2240,7 @@ def show_dashboard():
                             f'<span style="display:inline-block;background:rgba(41,121,255,.1);'
                             f'border:1px solid rgba(41,121,255,.28);color:#2979ff;font-size:.72rem;'
                             f'font-weight:600;border-radius:99px;padding:.24rem .75rem;'
-                            f'margin:.2rem .25rem .2rem 0;">{fa}</span>'
+                            f'margin:.2rem .25rem .2rem 0;">{_esc(fa)}</span>'
                             for fa in focus_areas
                         )
                         pills_html = (
@@ -2111,7 +2252,7 @@ def show_dashboard():
                     else:
                         pills_html = ""
 
-                    st.markdown(f"""
+                    st.html(after_chart + f"""
 <div style="background:#04080f;border:1px solid #192035;border-left:3px solid #2979ff;
             border-radius:12px;padding:1.15rem 1.3rem;margin-bottom:.3rem;">
   <div style="font-size:.62rem;font-weight:700;letter-spacing:.12em;text-transform:uppercase;
@@ -2119,12 +2260,12 @@ def show_dashboard():
     {icon("search","#2979ff",12,2)}&nbsp;Why This Conclusion Was Reached
   </div>
   <p style="font-size:.87rem;color:#CBD5E1;line-height:1.7;margin:0 0 .9rem;">
-    {explain.get("explanation_summary", "—")}</p>
+    {_esc(explain.get("explanation_summary", "—"))}</p>
   {ev_bullets}
   <div style="margin-top:.85rem;">
     <div style="display:flex;justify-content:space-between;align-items:center;margin-bottom:.4rem;">
       <span style="font-size:.65rem;font-weight:600;color:#555;letter-spacing:.07em;text-transform:uppercase;">Confidence Level</span>
-      <span style="font-size:.78rem;font-weight:700;color:{conf_color};">{conf}</span>
+      <span style="font-size:.78rem;font-weight:700;color:{conf_color};">{_esc(conf)}</span>
     </div>
     <div style="background:rgba(255,255,255,.06);border-radius:99px;height:5px;overflow:hidden;">
       <div style="height:5px;width:{conf_pct}%;background:{conf_color};border-radius:99px;
@@ -2132,7 +2273,7 @@ def show_dashboard():
     </div>
   </div>
   {pills_html}
-</div>""", unsafe_allow_html=True)
+</div>""")
 
         # ── 6. Recommended next steps ─────────────────────────────
         steps = normalize_next_steps(data.get("recommended_next_steps"))
@@ -2140,15 +2281,14 @@ def show_dashboard():
             steps_html = "".join(
                 f'<div style="display:flex;gap:.7rem;align-items:flex-start;margin-bottom:.52rem;">'
                 f'<span style="margin-top:2px;flex-shrink:0;">{icon("arrow-r","#2979ff",13,2.2)}</span>'
-                f'<span style="color:#c0c8d8;font-size:.87rem;line-height:1.62">{s}</span>'
+                f'<span style="color:#c0c8d8;font-size:.87rem;line-height:1.62">{_esc(s)}</span>'
                 f'</div>'
                 for s in steps
             )
-            st.markdown(
+            st.html(
                 f'<div class="sg-card">'
                 f'<div style="font-size:.67rem;font-weight:700;letter-spacing:.13em;text-transform:uppercase;'
-                f'color:#2979ff;margin-bottom:.75rem;">Recommended Next Steps</div>{steps_html}</div>',
-                unsafe_allow_html=True,
+                f'color:#2979ff;margin-bottom:.75rem;">Recommended Next Steps</div>{steps_html}</div>'
             )
 
         st.markdown("<div style='height:.6rem'></div>", unsafe_allow_html=True)
@@ -2661,6 +2801,14 @@ def show_settings():
                         st.markdown("<div style='height:.5rem'></div>", unsafe_allow_html=True)
                         if st.button("Save Student IDs", key="admin_save_sids"):
                             try:
+                                _bad = [
+                                    _v for _v in (str(_x or "").strip() for _x in _edited["Student ID"])
+                                    if _v and not _valid_student_id(_v)
+                                ]
+                                if _bad:
+                                    raise ValueError(
+                                        f"invalid Student ID {_bad[0]!r} — use letters, digits, - and _ (max 32)"
+                                    )
                                 _full = read_table(_as, "users")
                                 if "student_id" not in _full.columns:
                                     _full["student_id"] = ""
@@ -2780,6 +2928,8 @@ def show_settings():
 
                 if not _ns_sid_clean:
                     _ns_errors.append("Student ID is required.")
+                elif not _valid_student_id(_ns_sid_clean):
+                    _ns_errors.append("Student ID may only contain letters, digits, - and _ (max 32).")
                 if not _ns_name_clean:
                     _ns_errors.append("Student Name is required.")
                 _ns_grade_int = None
@@ -2862,26 +3012,37 @@ def show_settings():
                             with st.spinner(
                                 f"Processing {_ns_sid_clean} through the AI pipeline..."
                             ):
-                                _npr = requests.post(
+                                _npr = SESSION.post(
                                     "https://ai-student-intelligence.onrender.com/run-pipeline",
                                     json={"student_id": _ns_sid_clean, "llm_provider": _ns_llm},
                                     timeout=30,
                                 )
-                            if _npr.ok:
+                                if _npr.ok:
+                                    _ns_status, _ns_err = _wait_for_pipeline(
+                                        _npr.json().get("job_id", ""), _ns_sid_clean
+                                    )
+                            if not _npr.ok:
+                                st.warning(
+                                    f"Pipeline returned HTTP {_npr.status_code}. "
+                                    "The report will appear in Google Sheets shortly."
+                                )
+                            elif _ns_status == "done":
                                 st.success(
                                     f"Report ready. Go to Dashboard and search "
                                     f"{_ns_sid_clean} to view."
                                 )
+                            elif _ns_status == "failed":
+                                st.error(f"Pipeline failed: {_ns_err}")
                             else:
-                                st.warning(
-                                    f"Pipeline returned HTTP {_npr.status_code}. "
-                                    "The report will appear in Google Sheets shortly."
+                                st.info(
+                                    f"{_ns_sid_clean} is still processing. "
+                                    "The Dashboard will refresh once the pipeline finishes."
                                 )
                         except Exception as _npe:
                             st.warning(f"Could not reach pipeline server: {_npe}")
                     else:
                         try:
-                            _npr = requests.post(
+                            _npr = SESSION.post(
                                 f"{API_BASE}/pipeline/run",
                                 json={
                                     "student_id": _ns_sid_clean,
@@ -2890,33 +3051,24 @@ def show_settings():
                                 timeout=20,
                             )
                             if _npr.ok:
-                                _job_id = _npr.json().get("job_id", "")
                                 with st.spinner(
                                     f"Processing {_ns_sid_clean} through the AI pipeline..."
                                 ):
-                                    _done = False
-                                    for _ in range(60):  # poll up to 5 minutes
-                                        time.sleep(5)
-                                        try:
-                                            _sr = requests.get(
-                                                f"{API_BASE}/pipeline/status/{_job_id}",
-                                                timeout=10,
-                                            )
-                                            _st_val = _sr.json().get("status", "running")
-                                            if _st_val == "done":
-                                                _done = True
-                                                break
-                                            if _st_val == "failed":
-                                                _err_msg = _sr.json().get("error", "")
-                                                st.error(f"Pipeline failed: {_err_msg}")
-                                                break
-                                        except Exception:
-                                            pass
-                                if _done:
+                                    _ns_status, _ns_err = _wait_for_pipeline(
+                                        _npr.json().get("job_id", ""), _ns_sid_clean
+                                    )
+                                if _ns_status == "done":
                                     st.success(
                                         f"Report ready. Go to Dashboard and search "
                                         f"{_ns_sid_clean} to view."
                                     )
+                                elif _ns_status == "failed":
+                                    st.error(f"Pipeline failed: {_ns_err}")
+                                else:
+                                    st.info(
+                                        f"{_ns_sid_clean} is still processing. "
+                                        "The Dashboard will refresh once the pipeline finishes."
+                                    )
                             else:
                                 st.warning(
                                     f"Could not start pipeline "